@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+from pyrecswitch import RSDeviceConfig, RSMessages, RSCommand
+from pyrecswitch.helpers import pack_mac_address, unpack_mac_address
+from pyrecswitch.simulator import RSSimulatedDevice
+
+default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'codec_baseline.json')
+mac_address = 'F0:FE:6B:12:34:56'
+registered_mac_address = 'F0:FE:6B:65:43:21'
+# speeds are compared relative to this case measured in the same run, absolute speeds depend on the machine
+reference_case = 'pack_mac_address'
+
+
+def device_config(use_encryption):
+    config = RSDeviceConfig(mac_address)
+    config.use_encryption = use_encryption
+    return config
+
+
+def build_cases():
+    cases = dict()
+    binary_mac_address = pack_mac_address(mac_address)
+    cases['pack_mac_address'] = lambda: pack_mac_address(mac_address)
+    cases['unpack_mac_address'] = lambda: unpack_mac_address(binary_mac_address)
+    cases['build_payload'] = lambda config=device_config(True): RSMessages.build_payload(config, 1, b'\x02\x00')
+
+    for use_encryption in (True, False):
+        suffix = 'encrypted' if use_encryption else 'plain'
+        config = device_config(use_encryption)
+        device = RSSimulatedDevice(mac_address)
+        device.device_config.use_encryption = use_encryption
+
+        cases['build_message.heart_beat.' + suffix] = lambda config=config: RSMessages.heart_beat(config)
+        cases['build_message.query_module_info.' + suffix] = lambda config=config: RSMessages.query_module_info(config)
+        cases['build_message.get_gpio_status.' + suffix] = \
+            lambda config=config: RSMessages.get_gpio_status(config, flag=0)
+        cases['build_message.set_gpio_status.' + suffix] = \
+            lambda config=config: RSMessages.set_gpio_status(config, 0, True)
+
+        _, request = RSMessages.set_gpio_status(config, 0, True)
+        requests = {command: RSMessages.parse_message(request)[3] for command in RSCommand}
+        for command in RSCommand:
+            if command == RSCommand.REPORT_GPIO_CHANGE:
+                datagram = device.report_gpio_change()
+            else:
+                datagram = device.handle(1, command, requests[command])
+            name = 'parse_message.{}.{}'.format(command.name.lower(), suffix)
+            cases[name] = lambda datagram=datagram: RSMessages.parse_message(datagram, with_header=True)
+
+        # a registered device holds its interned config, its packets reuse it
+        registered_device = RSSimulatedDevice(registered_mac_address)
+        registered_device.device_config.use_encryption = use_encryption
+        datagram = registered_device.report_gpio_change()
+        cases['parse_message.registered_device.' + suffix] = \
+            lambda datagram=datagram, config=RSDeviceConfig.intern(registered_mac_address): \
+            RSMessages.parse_message(datagram, with_header=True)
+
+    return cases
+
+
+def calibrate(timer, min_time):
+    number, _ = timer.autorange()
+    return max(number, int(number * min_time / 0.2))
+
+
+def measure(function, reference, min_time):
+    # the case and the reference take turns, a machine slowing down slows both and their ratio holds
+    timer, reference_timer = timeit.Timer(function), timeit.Timer(reference)
+    number, reference_number = calibrate(timer, min_time), calibrate(reference_timer, min_time)
+    best = reference_best = float('inf')
+    for _ in range(5):
+        best = min(best, timer.timeit(number) / number)
+        reference_best = min(reference_best, reference_timer.timeit(reference_number) / reference_number)
+
+    # peak bytes held while one call runs, what it allocates for its temporaries and result
+    function()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    current, _ = tracemalloc.get_traced_memory()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'ops_per_sec': round(1 / best), 'relative_speed': round(reference_best / best, 4),
+            'alloc_bytes': peak - current}
+
+
+def compare(results, baseline, tolerance):
+    regressions = list()
+    for name, result in sorted(results.items()):
+        reference = baseline.get(name)
+        status = ''
+        if reference:
+            if result['relative_speed'] < reference['relative_speed'] * (1 - tolerance):
+                status = 'SLOWER'
+            elif result['alloc_bytes'] > reference['alloc_bytes'] * (1 + tolerance) + 64:
+                status = 'MORE ALLOC'
+            if status:
+                regressions.append(name)
+        print('{:48} {:>10} ops/s {:>7.3f}x {:>7} B/op {:>10} {}'.format(
+            name, result['ops_per_sec'], result['relative_speed'], result['alloc_bytes'],
+            '({:+.0%})'.format(result['relative_speed'] / reference['relative_speed'] - 1) if reference else '(new)',
+            status))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='micro benchmarks for RSMessages build and parse paths')
+    parser.add_argument('--baseline', default=default_baseline)
+    parser.add_argument('--update', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative regression')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds per measurement')
+    parser.add_argument('--filter', default='', help='only run cases containing this string')
+    args = parser.parse_args(argv)
+
+    cases = build_cases()
+    results = {name: measure(function, cases[reference_case], args.min_time)
+               for name, function in cases.items() if args.filter in name}
+
+    if args.update:
+        with open(args.baseline, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+            fh.write('\n')
+        compare(results, dict(), args.tolerance)
+        return 0
+
+    baseline = dict()
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print('{} regression(s) against {}: {}'.format(len(regressions), args.baseline, ', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+import argparse
+import asyncio
+import multiprocessing
+import sys
+import time
+
+from pyrecswitch import RSNetwork, RSNetworkError
+from pyrecswitch.exceptions import RSTimeoutError
+from pyrecswitch.simulator import RSSimulator
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def create_simulator(args, report_address):
+    return RSSimulator(RSSimulator.create_devices(args.devices), latency=args.latency, jitter=args.jitter,
+                       loss=args.loss, report_address=report_address, report_rate=args.report_rate)
+
+
+def run_simulator(args, report_address, connection):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    simulator = create_simulator(args, report_address)
+    loop.run_until_complete(simulator.create_datagram_endpoint(loop=loop))
+    connection.send(simulator.local_address)
+    loop.run_forever()
+
+
+async def run(args):
+    loop = asyncio.get_event_loop()
+
+    net = RSNetwork(max_in_flight=args.max_in_flight, send_rate=args.send_rate, device_send_rate=args.device_send_rate)
+    net.datagram.timeout_interval = args.timeout
+    net_transport, _ = await net.create_datagram_endpoint(local_ip_address='127.0.0.1', local_port=0,
+                                                          batched=args.batched)
+    report_address = net_transport.get_extra_info('sockname')
+
+    # by default the fleet runs in its own process, so cpu time is only spent by the library
+    simulator = None
+    process = None
+    if args.in_process:
+        simulator = create_simulator(args, report_address)
+        sim_transport, _ = await simulator.create_datagram_endpoint()
+        sim_ip_address, sim_port = simulator.local_address
+    else:
+        connection, child_connection = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=run_simulator, args=(args, report_address, child_connection),
+                                          daemon=True)
+        process.start()
+        sim_ip_address, sim_port = await loop.run_in_executor(None, connection.recv)
+
+    mac_addresses = [device.device_config.mac_address for device in RSSimulator.create_devices(args.devices)]
+    devices = [net.register_device(mac_address, sim_ip_address, port=sim_port,
+                                   retransmissions=args.retransmissions, heart_beat=args.heart_beat)
+               for mac_address in mac_addresses]
+
+    latencies = list()
+    timeouts = 0
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def request(index):
+        nonlocal timeouts, errors
+        device = devices[index % len(devices)]
+        start_time = loop.time()
+        try:
+            if args.command == 'set':
+                await device.set_gpio_status(bool(index % 2))
+            else:
+                await device.get_gpio_status()
+            latencies.append(loop.time() - start_time)
+        except RSTimeoutError:
+            timeouts += 1
+        except RSNetworkError:
+            errors += 1
+        finally:
+            semaphore.release()
+
+    start_time = time.perf_counter()
+    start_cpu = time.process_time()
+
+    tasks = list()
+    for index in range(args.requests):
+        await semaphore.acquire()
+        tasks.append(asyncio.ensure_future(request(index)))
+    await asyncio.gather(*tasks)
+
+    elapsed = time.perf_counter() - start_time
+    cpu = time.process_time() - start_cpu
+
+    net_transport.close()
+    if process:
+        process.terminate()
+    else:
+        sim_transport.close()
+
+    latencies.sort()
+    print('devices:          {}'.format(args.devices))
+    print('requests:         {}'.format(args.requests))
+    print('requests/sec:     {:.0f}'.format(args.requests / elapsed))
+    print('latency p50:      {:.2f} ms'.format(percentile(latencies, 0.50) * 1000))
+    print('latency p99:      {:.2f} ms'.format(percentile(latencies, 0.99) * 1000))
+    print('timeout rate:     {:.2%}'.format(timeouts / args.requests))
+    print('error rate:       {:.2%}'.format(errors / args.requests))
+    print('cpu per request:  {:.1f} us'.format(cpu / args.requests * 1e6))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='drive RSNetwork against a loopback RecSwitch fleet')
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--command', choices=('get', 'set'), default='get')
+    parser.add_argument('--latency', type=float, default=0.0, help='reply latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='additional random reply latency in seconds')
+    parser.add_argument('--loss', type=float, default=0.0, help='packet loss probability, each direction')
+    parser.add_argument('--report-rate', type=float, default=0.0, help='unsolicited reports per second')
+    parser.add_argument('--timeout', type=float, default=5.0)
+    parser.add_argument('--retransmissions', type=int, default=0)
+    parser.add_argument('--max-in-flight', type=int, default=None)
+    parser.add_argument('--send-rate', type=float, default=None, help='packets per second sent by the network')
+    parser.add_argument('--device-send-rate', type=float, default=None, help='packets per second sent to a device')
+    parser.add_argument('--heart-beat', action='store_true', help='run the heart beat scheduler')
+    parser.add_argument('--batched', action='store_true', help='use the batched datagram endpoint')
+    parser.add_argument('--in-process', action='store_true', help='run the simulated fleet in this process')
+    args = parser.parse_args(argv)
+
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
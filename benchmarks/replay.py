@@ -0,0 +1,84 @@
+import argparse
+import asyncio
+import sys
+import time
+
+from pyrecswitch import RSNetwork, RSMessages, RSInvalidMessage
+from pyrecswitch.captures import RSCaptureReader, replay
+
+
+def replay_parser(path, repeat):
+    count = 0
+    invalid = 0
+    # loaded first, as received from a socket, only the parsing is timed
+    with RSCaptureReader(path) as reader:
+        datagrams = [datagram for _, datagram, _ in reader]
+
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        for datagram in datagrams:
+            try:
+                RSMessages.parse_message(datagram, with_header=True)
+            except RSInvalidMessage:
+                invalid += 1
+            count += 1
+    elapsed = time.perf_counter() - start_time
+    return count, invalid, elapsed
+
+
+async def replay_protocol(path, repeat, speed, register):
+    net = RSNetwork()
+    if register:
+        # the senders of the capture become registered devices, their reports reach the callbacks
+        with RSCaptureReader(path) as reader:
+            mac_addresses = set()
+            for _, datagram, remote_address in reader:
+                try:
+                    device_config = RSMessages.parse_message(datagram)[0]
+                except RSInvalidMessage:
+                    continue
+                if device_config.mac_address not in mac_addresses and remote_address:
+                    mac_addresses.add(device_config.mac_address)
+                    device = net.register_device(device_config.mac_address, remote_address[0],
+                                                 port=remote_address[1], heart_beat=False)
+                    device.report_gpio_change = lambda response: None
+
+    count = 0
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        with RSCaptureReader(path) as reader:
+            count += await replay(reader, net.datagram, speed=speed)
+    await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start_time
+    return count, net.metrics.decode_failures, elapsed, net.metrics
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='replay a datagram capture through the parser or RSProtocol')
+    parser.add_argument('capture', help='file written by RSNetwork.start_capture')
+    parser.add_argument('--target', choices=('parser', 'protocol'), default='parser')
+    parser.add_argument('--speed', type=float, default=None,
+                        help='replay at the captured pace times speed, as fast as possible by default')
+    parser.add_argument('--repeat', type=int, default=1, help='replay the capture this many times')
+    parser.add_argument('--register', action='store_true', help='register the senders as devices')
+    args = parser.parse_args(argv)
+
+    if args.target == 'parser':
+        count, invalid, elapsed = replay_parser(args.capture, args.repeat)
+        metrics = None
+    else:
+        count, invalid, elapsed, metrics = asyncio.get_event_loop().run_until_complete(
+            replay_protocol(args.capture, args.repeat, args.speed, args.register))
+
+    print('datagrams:        {}'.format(count))
+    print('invalid:          {}'.format(invalid))
+    print('elapsed:          {:.3f} s'.format(elapsed))
+    print('datagrams/sec:    {:.0f}'.format(count / elapsed if elapsed else 0))
+    if metrics:
+        print('broadcasts:       {}'.format(metrics.broadcasts_received))
+        print('unknown index:    {}'.format(metrics.unknown_index_responses))
+        print('callbacks:        {}'.format(metrics.callbacks_dispatched))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
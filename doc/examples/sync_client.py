@@ -0,0 +1,47 @@
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pyrecswitch import RSNetworkError
+from pyrecswitch.clients import RSSyncClient
+
+
+def polling(device):
+    try:
+        # get module info
+        ret = device.query_module_info()
+        print('QUERY MODULE INFO: device_name={0.device_name} sw_version={0.sw_version}'.format(ret))
+
+        # get relay status
+        ret = device.get_gpio_status()
+        print('GET GPIO STATUS: flag={0.flag} state={0.state}'.format(ret))
+
+        # set relay status to inverse value
+        ret = device.set_gpio_status(not ret.state)
+        print('SET GPIO STATUS: flag={0.flag} state={0.state}'.format(ret))
+
+        time.sleep(interval)
+
+        # set relay status to initial value
+        ret = device.set_gpio_status(not ret.state)
+        print('SET GPIO STATUS: flag={0.flag} state={0.state}'.format(ret))
+
+    except RSNetworkError:
+        print('network error occurred, sleep')
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 3 or len(sys.argv) % 2 == 0:
+        print('usage: {} ip-address mac-address [ip-address mac-address ...]'.format(sys.argv[0]))
+        sys.exit(1)
+
+    interval = 2
+    remote_addresses = list(zip(sys.argv[1::2], sys.argv[2::2]))
+
+    with RSSyncClient() as client:
+        devices = [client.register_device(mac_address, ip_address) for ip_address, mac_address in remote_addresses]
+
+        # every thread shares the client socket
+        with ThreadPoolExecutor(max_workers=len(devices)) as executor:
+            list(executor.map(polling, devices))
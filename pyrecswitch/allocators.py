@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- Mode: Python; tab-width: 4 -*-
+#
+# pyrecswitch - interface for controlling Ankuoo RecSwitch MS6126
+# Copyright (C) 2018 Marco Lertora <marco.lertora@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+from collections import deque
+from random import randint
+
+from .structures import RSDeviceConfig
+
+
+class RSMessageIndexAllocator:
+
+    def __init__(self, window=None, min_index=RSDeviceConfig.min_message_index,
+                 max_index=RSDeviceConfig.max_message_index):
+        size = max_index - min_index + 1
+        self.window = min(window, size) if window else size
+        self.in_flight = 0
+        self.waiters = deque()
+
+        # released indexes go to the tail, so the least recently used index is reused first
+        # and a late response is unlikely to match a newer request
+        start = randint(min_index, max_index)
+        self.free = deque(range(start, max_index + 1))
+        self.free.extend(range(min_index, start))
+        self.queued = bytearray(b'\x01') * (max_index + 1)
+        self.in_use = bytearray(max_index + 1)
+
+    def __len__(self):
+        return self.in_flight
+
+    def __contains__(self, message_index):
+        return bool(self.in_use[message_index])
+
+    def is_full(self):
+        return self.in_flight >= self.window
+
+    def acquire_nowait(self):
+        if self.is_full():
+            return None
+
+        while self.free:
+            message_index = self.free.popleft()
+            self.queued[message_index] = 0
+            if not self.in_use[message_index]:
+                self.in_use[message_index] = 1
+                self.in_flight += 1
+                return message_index
+
+        return None
+
+    async def acquire(self):
+        if not self.waiters:
+            message_index = self.acquire_nowait()
+            if message_index is not None:
+                return message_index
+
+        waiter = asyncio.get_event_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(waiter.result())
+            raise
+
+    def release(self, message_index):
+        if not self.in_use[message_index]:
+            return
+
+        self.in_use[message_index] = 0
+        self.in_flight -= 1
+        if not self.queued[message_index]:
+            self.queued[message_index] = 1
+            self.free.append(message_index)
+
+        while self.waiters and not self.is_full():
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(self.acquire_nowait())
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- Mode: Python; tab-width: 4 -*-
+#
+# pyrecswitch - interface for controlling Ankuoo RecSwitch MS6126
+# Copyright (C) 2018 Marco Lertora <marco.lertora@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import mmap
+import os
+import socket
+import struct
+import time
+
+capture_magic = b'RSCAP\x01'
+# received at (unix time), source port, source ip address length, datagram length
+record_struct = struct.Struct('!dHBH')
+
+
+class RSCaptureWriter:
+
+    # appends the datagrams received to a capture file, each with its time and source address
+    def __init__(self, path):
+        self.fh = open(path, 'ab')
+        if self.fh.tell() == 0:
+            self.fh.write(capture_magic)
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, datagram, remote_address=None, received_time=None):
+        received_time = received_time if received_time is not None else time.time()
+        if remote_address:
+            family = socket.AF_INET6 if ':' in remote_address[0] else socket.AF_INET
+            ip_address = socket.inet_pton(family, remote_address[0])
+            port = remote_address[1]
+        else:
+            ip_address = b''
+            port = 0
+
+        self.fh.write(record_struct.pack(received_time, port, len(ip_address), len(datagram)))
+        self.fh.write(ip_address)
+        self.fh.write(datagram)
+        self.count += 1
+
+    def flush(self):
+        self.fh.flush()
+
+    def close(self):
+        self.fh.close()
+
+
+class RSCaptureReader:
+
+    # iterates (received_time, datagram, remote_address) over a memory mapped capture file,
+    # only the pages being read are loaded
+    def __init__(self, path):
+        self.data = None
+        if os.path.getsize(path) < len(capture_magic):
+            raise ValueError('invalid capture file: {}'.format(path))
+
+        with open(path, 'rb') as fh:
+            self.data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(capture_magic)] != capture_magic:
+            self.close()
+            raise ValueError('invalid capture file: {}'.format(path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        data = self.data
+        offset = len(capture_magic)
+        # a record cut short by a crash of the writer ends the capture
+        while offset + record_struct.size <= len(data):
+            received_time, port, ip_address_length, length = record_struct.unpack_from(data, offset)
+            offset += record_struct.size
+            if offset + ip_address_length + length > len(data):
+                break
+
+            remote_address = None
+            if ip_address_length:
+                family = socket.AF_INET6 if ip_address_length == 16 else socket.AF_INET
+                remote_address = (socket.inet_ntop(family, data[offset:offset + ip_address_length]), port)
+            offset += ip_address_length
+
+            yield received_time, data[offset:offset + length], remote_address
+            offset += length
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+
+
+async def replay(records, protocol, speed=None, yield_every=256):
+    # feeds captured datagrams to a protocol, at the original pace times speed or, without speed, as fast as
+    # possible, giving the loop a chance to run the callbacks every few datagrams
+    loop = asyncio.get_event_loop()
+    start_time = loop.time()
+    first_time = None
+    count = 0
+
+    for received_time, datagram, remote_address in records:
+        if speed:
+            first_time = received_time if first_time is None else first_time
+            delay = start_time + (received_time - first_time) / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif count % yield_every == 0:
+            await asyncio.sleep(0)
+
+        protocol.datagram_received(datagram, remote_address)
+        count += 1
+
+    return count
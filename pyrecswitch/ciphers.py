@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- Mode: Python; tab-width: 4 -*-
+#
+# pyrecswitch - interface for controlling Ankuoo RecSwitch MS6126
+# Copyright (C) 2018 Marco Lertora <marco.lertora@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+class RSPyCryptodomeBackend:
+    name = 'pycryptodome'
+
+    # the AES libraries are imported on first use, importing pyrecswitch stays cheap
+    def __init__(self, aes_key):
+        from Crypto.Cipher import AES
+        ecb = AES.new(aes_key, AES.MODE_ECB)
+        self.encrypt = ecb.encrypt
+        self.decrypt = ecb.decrypt
+
+
+class RSCryptographyBackend:
+    name = 'cryptography'
+
+    def __init__(self, aes_key):
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+        cipher = Cipher(algorithms.AES(aes_key), modes.ECB())
+        # ecb contexts are never finalized, each update of whole blocks returns whole blocks
+        self.encrypt = cipher.encryptor().update
+        self.decrypt = cipher.decryptor().update
+
+
+# name -> class, constructed with the aes key they provide encrypt(data) and decrypt(data) in ECB mode
+cipher_backends = {
+    RSPyCryptodomeBackend.name: RSPyCryptodomeBackend,
+    RSCryptographyBackend.name: RSCryptographyBackend,
+}
+
+# tried in order when a device config doesn't choose
+default_cipher_backends = (RSPyCryptodomeBackend.name, RSCryptographyBackend.name)
+
+
+def register_cipher_backend(backend):
+    cipher_backends[backend.name] = backend
+
+
+def create_cipher_backend(name, aes_key):
+    if name is not None:
+        try:
+            backend = cipher_backends[name]
+        except KeyError:
+            raise ValueError('unknown cipher backend: {}'.format(name))
+        return backend(aes_key)
+
+    for name in default_cipher_backends:
+        try:
+            return cipher_backends[name](aes_key)
+        except ImportError:
+            continue
+    raise ImportError('no AES library available, install one of: {}'.format(', '.join(default_cipher_backends)))
+
+
+class RSCipher:
+    block_size = 16
+    instances = dict()
+
+    # AES-CBC on top of a reusable ECB object, CBC objects can't be rewound to the iv
+    def __init__(self, aes_key, aes_iv, backend=None):
+        self.ecb = create_cipher_backend(backend, aes_key)
+        self.aes_iv = aes_iv
+
+    @staticmethod
+    def get(aes_key, aes_iv, backend=None):
+        key = (aes_key, aes_iv, backend)
+        cipher = RSCipher.instances.get(key)
+        if cipher is None:
+            cipher = RSCipher.instances[key] = RSCipher(aes_key, aes_iv, backend)
+        return cipher
+
+    def encrypt(self, data):
+        if len(data) % self.block_size:
+            raise ValueError('data must be aligned to block boundary')
+
+        chain = int.from_bytes(self.aes_iv, 'big')
+        encrypted = bytearray()
+        for offset in range(0, len(data), self.block_size):
+            block = int.from_bytes(data[offset:offset + self.block_size], 'big') ^ chain
+            block = self.ecb.encrypt(block.to_bytes(self.block_size, 'big'))
+            chain = int.from_bytes(block, 'big')
+            encrypted += block
+        return bytes(encrypted)
+
+    def decrypt(self, data):
+        if not data:
+            return b''
+        if len(data) % self.block_size:
+            raise ValueError('data must be aligned to block boundary')
+
+        decrypted = self.ecb.decrypt(data)
+        chain = self.aes_iv + data[:-self.block_size]
+        return (int.from_bytes(decrypted, 'big') ^ int.from_bytes(chain, 'big')).to_bytes(len(data), 'big')
+
+    def encrypt_many(self, messages):
+        # the n-th blocks of all the messages go through one ECB call, the chaining runs across messages
+        for data in messages:
+            if len(data) % self.block_size:
+                raise ValueError('data must be aligned to block boundary')
+
+        size = self.block_size
+        encrypted = [bytearray() for _ in messages]
+        chains = [int.from_bytes(self.aes_iv, 'big')] * len(messages)
+        pending = [index for index, data in enumerate(messages) if data]
+        offset = 0
+        while pending:
+            blocks = b''.join((int.from_bytes(messages[index][offset:offset + size], 'big') ^ chains[index])
+                              .to_bytes(size, 'big') for index in pending)
+            blocks = self.ecb.encrypt(blocks)
+            for position, index in enumerate(pending):
+                block = blocks[position * size:(position + 1) * size]
+                chains[index] = int.from_bytes(block, 'big')
+                encrypted[index] += block
+
+            offset += size
+            pending = [index for index in pending if len(messages[index]) > offset]
+        return [bytes(data) for data in encrypted]
+
+    def decrypt_many(self, messages):
+        # all the messages go through one ECB call
+        for data in messages:
+            if len(data) % self.block_size:
+                raise ValueError('data must be aligned to block boundary')
+
+        data = b''.join(messages)
+        decrypted = self.ecb.decrypt(data) if data else b''
+        ret = list()
+        offset = 0
+        for data in messages:
+            length = len(data)
+            chain = self.aes_iv + data[:-self.block_size] if length else b''
+            value = int.from_bytes(decrypted[offset:offset + length], 'big') ^ int.from_bytes(chain, 'big')
+            ret.append(value.to_bytes(length, 'big'))
+            offset += length
+        return ret
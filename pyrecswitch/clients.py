@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- Mode: Python; tab-width: 4 -*-
+#
+# pyrecswitch - interface for controlling Ankuoo RecSwitch MS6126
+# Copyright (C) 2018 Marco Lertora <marco.lertora@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import socket
+import threading
+from concurrent.futures import Future, TimeoutError
+
+from .allocators import RSMessageIndexAllocator
+from .constants import RSCommand
+from .exceptions import RSTimeoutError, RSTransportError, RSInvalidMessage
+from .helpers import is_reply, moved_ip_address, pack_mac_address
+from .messages import RSMessages
+from .structures import RSDeviceConfig
+
+logger = logging.getLogger(__name__)
+
+
+class RSSyncDevice:
+
+    # blocking counterpart of RSDevice, safe to use from many threads at once
+    def __init__(self, parent, mac_address, ip_address, port=None):
+        self.parent = parent
+        self.port = port if port else RSDeviceConfig.default_udp_port
+        self.ip_address = ip_address
+        self.device_config = RSDeviceConfig.intern(mac_address)
+        self.report_gpio_change = None
+
+    def heart_beat(self, timeout=None):
+        return self.parent.send_request(self, RSMessages.heart_beat, timeout=timeout)
+
+    def query_module_info(self, timeout=None):
+        return self.parent.send_request(self, RSMessages.query_module_info, timeout=timeout)
+
+    def get_gpio_status(self, timeout=None):
+        return self.parent.send_request(self, RSMessages.get_gpio_status, timeout=timeout, flag=0)
+
+    def set_gpio_status(self, state, timeout=None):
+        return self.parent.send_request(self, RSMessages.set_gpio_status, timeout=timeout, flag=0, state=state)
+
+
+class RSSyncClient:
+
+    # one socket shared by all the threads, a receiver thread hands each response to the caller waiting for its
+    # message index. report callbacks run in the receiver thread, they must not block
+    def __init__(self, local_ip_address=None, local_port=None, timeout_interval=5, max_in_flight=None,
+                 poll_interval=0.5):
+        self.timeout_interval = timeout_interval
+        self.poll_interval = poll_interval
+        self.devices = dict()
+        self.messages = dict()
+        self.message_indexes = RSMessageIndexAllocator(window=max_in_flight)
+        self.lock = threading.Lock()
+        self.index_available = threading.Condition(self.lock)
+        self.sock = None
+        self.receiver = None
+        self.running = False
+        self.local_ip_address = local_ip_address if local_ip_address else '0.0.0.0'
+        self.local_port = local_port if local_port is not None else RSDeviceConfig.default_udp_port
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.bind((self.local_ip_address, self.local_port))
+            # the receiver wakes up periodically to notice close()
+            sock.settimeout(self.poll_interval)
+        except OSError:
+            sock.close()
+            raise
+
+        self.sock = sock
+        self.running = True
+        self.receiver = threading.Thread(target=self.receive_loop, name='pyrecswitch-receiver', daemon=True)
+        self.receiver.start()
+
+    def close(self):
+        self.running = False
+        if self.receiver is not None:
+            self.receiver.join()
+            self.receiver = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+        with self.lock:
+            messages, self.messages = self.messages, dict()
+        for _, future in messages.values():
+            if not future.done():
+                future.set_exception(RSTransportError('client closed'))
+
+    def local_address(self):
+        return self.sock.getsockname()
+
+    def register_device(self, mac_address, ip_address, port=None):
+        device = RSSyncDevice(self, mac_address, ip_address, port=port)
+        self.devices[device.device_config.binary_mac_address] = device
+        return device
+
+    def unregister_device(self, mac_address):
+        try:
+            self.devices.pop(pack_mac_address(mac_address))
+        except (KeyError, ValueError):
+            raise KeyError(mac_address) from None
+
+    def get_device(self, mac_address):
+        try:
+            return self.devices[pack_mac_address(mac_address)]
+        except (KeyError, ValueError):
+            raise KeyError(mac_address) from None
+
+    def receive_loop(self):
+        while self.running:
+            try:
+                datagram, remote_address = self.sock.recvfrom(8192)
+            except socket.timeout:
+                continue
+            except OSError:
+                if not self.running:
+                    return
+                continue
+            self.datagram_process(datagram, remote_address)
+
+    def datagram_process(self, datagram, remote_address=None):
+        try:
+            device_config, message_index, command, response, header = RSMessages.parse_message(datagram, with_header=True)
+        except RSInvalidMessage:
+            return
+
+        device = self.devices.get(device_config.binary_mac_address)
+
+        future = None
+        with self.lock:
+            reply = is_reply(device_config.binary_mac_address, header, message_index, self.messages)
+            if reply:
+                _, future = self.messages.pop(message_index)
+
+        if device:
+            ip_address = moved_ip_address(device.ip_address, remote_address, command, reply)
+            if ip_address:
+                device.ip_address = ip_address
+
+        if command != RSCommand.REPORT_GPIO_CHANGE:
+            if future is not None and not future.done():
+                future.set_result(response)
+            return
+
+        if device and device.report_gpio_change:
+            try:
+                device.report_gpio_change(response)
+            except Exception:
+                logger.exception('callback %r failed', device.report_gpio_change)
+
+    def acquire(self, timeout):
+        with self.index_available:
+            message_index = self.message_indexes.acquire_nowait()
+            if message_index is None:
+                self.index_available.wait_for(lambda: not self.message_indexes.is_full(), timeout)
+                message_index = self.message_indexes.acquire_nowait()
+            if message_index is None:
+                raise RSTimeoutError
+            return message_index
+
+    def release(self, message_index):
+        with self.index_available:
+            self.messages.pop(message_index, None)
+            self.message_indexes.release(message_index)
+            self.index_available.notify()
+
+    def send_request(self, device, build_message, timeout=None, **kwargs):
+        if not self.running:
+            raise RSTransportError('client not started')
+
+        timeout = timeout if timeout else self.timeout_interval
+        message_index = self.acquire(timeout)
+        try:
+            message_index, packet = build_message(device.device_config, message_index=message_index, **kwargs)
+            future = Future()
+            with self.lock:
+                self.messages[message_index] = (device.device_config.binary_mac_address, future)
+            try:
+                self.sock.sendto(packet, (device.ip_address, device.port))
+            except OSError as e:
+                raise RSTransportError(e)
+
+            try:
+                return future.result(timeout)
+            except TimeoutError:
+                raise RSTimeoutError
+        finally:
+            self.release(message_index)
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- Mode: Python; tab-width: 4 -*-
+#
+# pyrecswitch - interface for controlling Ankuoo RecSwitch MS6126
+# Copyright (C) 2018 Marco Lertora <marco.lertora@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import itertools
+import multiprocessing
+import zlib
+
+from .dispatchers import RSDispatcher
+from .exceptions import RSTimeoutError, RSTransportError
+from .helpers import normalize_mac_address
+from .interfaces import RSNetwork
+from .structures import RSDeviceConfig
+
+
+def shard_index(binary_mac_address, workers):
+    return zlib.crc32(binary_mac_address) % workers
+
+
+def run_worker(connection, local_ip_address, network_options):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    worker = RSClusterWorker(connection, network_options)
+    loop.run_until_complete(worker.start(local_ip_address))
+    loop.run_forever()
+    worker.network.close()
+
+    # the calls still running and the tasks cancelled by close() need the loop to finish
+    tasks = asyncio.all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+    loop.close()
+
+
+class RSClusterWorker:
+
+    # owns the RSNetwork of one shard, runs in its own process
+    def __init__(self, connection, network_options):
+        self.connection = connection
+        self.network = RSNetwork(**network_options)
+        self.transport = None
+
+    async def start(self, local_ip_address):
+        loop = asyncio.get_event_loop()
+        self.transport, _ = await self.network.create_datagram_endpoint(local_ip_address=local_ip_address,
+                                                                        local_port=0)
+        loop.add_reader(self.connection.fileno(), self.receive)
+
+    def receive(self):
+        while self.connection.poll():
+            try:
+                message = self.connection.recv()
+            except EOFError:
+                asyncio.get_event_loop().stop()
+                return
+            getattr(self, 'on_' + message[0])(*message[1:])
+
+    def on_register(self, mac_address, ip_address, port, options):
+        device = self.network.register_device(mac_address, ip_address, port=port, **options)
+        mac_address = device.device_config.mac_address
+        device.report_gpio_change = lambda response: self.connection.send(('event', mac_address, response))
+
+    def on_unregister(self, mac_address):
+        self.network.unregister_device(mac_address)
+
+    def on_datagram(self, datagram, remote_address):
+        self.network.datagram.datagram_process(datagram, remote_address)
+
+    def on_call(self, call_id, mac_address, method, args, kwargs):
+        asyncio.ensure_future(self.call(call_id, mac_address, method, args, kwargs))
+
+    def on_stop(self):
+        asyncio.get_event_loop().stop()
+
+    async def call(self, call_id, mac_address, method, args, kwargs):
+        try:
+            device = self.network.get_device(mac_address)
+            ret = await getattr(device, method)(*args, **kwargs)
+        except Exception as e:
+            self.connection.send(('result', call_id, False, e))
+        else:
+            self.connection.send(('result', call_id, True, ret))
+
+
+class RSClusterDevice:
+
+    # same coroutine api as RSDevice, the requests run in the worker owning the device
+    def __init__(self, parent, mac_address, ip_address, port=None):
+        self.parent = parent
+        self.ip_address = ip_address
+        self.port = port if port else RSDeviceConfig.default_udp_port
+        self.device_config = RSDeviceConfig.intern(mac_address)
+        self.options = dict()
+        self.worker = shard_index(self.device_config.binary_mac_address, parent.worker_count)
+        self.report_gpio_change = None
+
+    async def heart_beat(self):
+        return await self.parent.call(self, 'heart_beat')
+
+    async def query_module_info(self):
+        return await self.parent.call(self, 'query_module_info')
+
+    async def get_gpio_status(self, max_age=None):
+        return await self.parent.call(self, 'get_gpio_status', max_age=max_age)
+
+    async def set_gpio_status(self, state):
+        return await self.parent.call(self, 'set_gpio_status', state)
+
+
+class RSClusterFrontProtocol(asyncio.DatagramProtocol):
+
+    # datagrams reaching the shared port, broadcasts mostly, go to the worker owning the mac address
+    def __init__(self, parent):
+        self.parent = parent
+
+    def datagram_received(self, datagram, remote_address):
+        binary_mac_address = bytes(datagram[2:8])
+        if len(binary_mac_address) == 6:
+            try:
+                self.parent.send(shard_index(binary_mac_address, self.parent.worker_count),
+                                 ('datagram', datagram, remote_address))
+            except RSTransportError:
+                pass
+
+
+class RSCluster:
+
+    # call_timeout bounds each call to a worker, a worker stuck or gone doesn't keep its callers waiting
+    def __init__(self, workers=None, call_timeout=30, **network_options):
+        self.worker_count = workers if workers else multiprocessing.cpu_count()
+        self.call_timeout = call_timeout
+        self.network_options = network_options
+        self.devices = dict()
+        self.workers = list()
+        self.lost_workers = set()
+        self.calls = dict()
+        self.call_ids = itertools.count(1)
+        self.dispatcher = RSDispatcher()
+        self.transport = None
+
+    async def start(self, local_ip_address=None, local_port=None):
+        loop = asyncio.get_event_loop()
+        local_ip_address = local_ip_address if local_ip_address else '0.0.0.0'
+        local_port = local_port if local_port is not None else RSDeviceConfig.default_udp_port
+
+        context = multiprocessing.get_context('spawn')
+        for worker in range(self.worker_count):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=run_worker, daemon=True,
+                                      args=(worker_connection, local_ip_address, self.network_options))
+            process.start()
+            worker_connection.close()
+            loop.add_reader(connection.fileno(), self.receive, worker)
+            self.workers.append((process, connection))
+
+        # devices registered before the start
+        for device in self.devices.values():
+            self.send_register(device)
+
+        self.transport, _ = await loop.create_datagram_endpoint(lambda: RSClusterFrontProtocol(self),
+                                                                local_addr=(local_ip_address, local_port))
+        return self.transport
+
+    async def stop(self):
+        loop = asyncio.get_event_loop()
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+
+        for process, connection in self.workers:
+            loop.remove_reader(connection.fileno())
+            try:
+                connection.send(('stop',))
+            except OSError:
+                pass
+        for process, connection in self.workers:
+            await loop.run_in_executor(None, process.join, 5)
+            if process.is_alive():
+                process.terminate()
+            connection.close()
+        self.workers = list()
+        self.lost_workers.clear()
+
+        for _, future in self.calls.values():
+            if not future.done():
+                future.set_exception(RSTransportError('cluster stopped'))
+        self.calls.clear()
+
+    def send(self, worker, message):
+        if worker in self.lost_workers:
+            raise RSTransportError('cluster worker {} lost'.format(worker))
+        try:
+            self.workers[worker][1].send(message)
+        except OSError as e:
+            self.worker_lost(worker)
+            raise RSTransportError('cluster worker {} lost'.format(worker)) from e
+
+    def worker_lost(self, worker):
+        # the calls pending on a dead worker would never get their result
+        if worker in self.lost_workers:
+            return
+        self.lost_workers.add(worker)
+        asyncio.get_event_loop().remove_reader(self.workers[worker][1].fileno())
+        for call_id, (call_worker, future) in list(self.calls.items()):
+            if call_worker == worker:
+                del self.calls[call_id]
+                if not future.done():
+                    future.set_exception(RSTransportError('cluster worker {} lost'.format(worker)))
+
+    def receive(self, worker):
+        connection = self.workers[worker][1]
+        while True:
+            try:
+                if not connection.poll():
+                    return
+                message = connection.recv()
+            except (EOFError, OSError):
+                self.worker_lost(worker)
+                return
+
+            if message[0] == 'result':
+                _, call_id, ok, value = message
+                _, future = self.calls.pop(call_id, (None, None))
+                if future is None or future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+            elif message[0] == 'event':
+                _, mac_address, response = message
+                device = self.devices.get(mac_address)
+                if device and device.report_gpio_change:
+                    self.dispatcher.dispatch(device.report_gpio_change, response)
+
+    async def call(self, device, method, *args, **kwargs):
+        if not self.workers:
+            raise RSTransportError('cluster not started')
+
+        call_id = next(self.call_ids)
+        future = asyncio.get_event_loop().create_future()
+        self.calls[call_id] = (device.worker, future)
+        try:
+            self.send(device.worker, ('call', call_id, device.device_config.mac_address, method, args, kwargs))
+            return await asyncio.wait_for(future, self.call_timeout)
+        except asyncio.TimeoutError:
+            raise RSTimeoutError
+        finally:
+            self.calls.pop(call_id, None)
+
+    def register_device(self, mac_address, ip_address, port=None, **options):
+        device = RSClusterDevice(self, mac_address, ip_address, port=port)
+        device.options = options
+        self.devices[device.device_config.mac_address] = device
+        if self.workers:
+            self.send_register(device)
+        return device
+
+    def send_register(self, device):
+        self.send(device.worker, ('register', device.device_config.mac_address, device.ip_address, device.port,
+                                  device.options))
+
+    def unregister_device(self, mac_address):
+        device = self.devices.pop(normalize_mac_address(mac_address))
+        if self.workers:
+            self.send(device.worker, ('unregister', mac_address))
+
+    def get_device(self, mac_address):
+        return self.devices[normalize_mac_address(mac_address)]
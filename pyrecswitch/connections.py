@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- Mode: Python; tab-width: 4 -*-
+#
+# pyrecswitch - interface for controlling Ankuoo RecSwitch MS6126
+# Copyright (C) 2018 Marco Lertora <marco.lertora@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import time
+
+from .exceptions import RSInvalidMessage, RSTransportError
+from .helpers import retrieve_exception
+from .messages import RSMessages
+
+
+class RSStreamConnection(asyncio.Protocol):
+
+    # a persistent tcp connection to a device, the messages cut from the stream go through the network protocol
+    # like datagrams. requests are pipelined, their responses are matched by message index
+    def __init__(self, parent, address):
+        self.parent = parent
+        self.address = address
+        self.transport = None
+        self.buffer = bytearray()
+        self.in_flight = dict()
+        self.last_used = time.monotonic()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self.parent.remove(self)
+
+        # the requests sent on this connection won't get an answer, don't let them wait for their timeout
+        datagram = self.parent.parent.datagram
+        for message_index, future in list(self.in_flight.items()):
+            entry = datagram.messages.get(message_index)
+            if entry is not None and entry[1] is future:
+                datagram.fail(message_index, RSTransportError('connection to {}:{} lost'.format(*self.address)))
+        self.in_flight.clear()
+
+    def is_closing(self):
+        return self.transport is None or self.transport.is_closing()
+
+    def data_received(self, data):
+        self.last_used = time.monotonic()
+        self.buffer += data
+        try:
+            frames = RSMessages.split_frames(self.buffer)
+        except RSInvalidMessage:
+            # out of sync, the stream can't be trusted any more
+            self.parent.parent.metrics.decode_failures += 1
+            self.transport.abort()
+            return
+
+        for frame in frames:
+            self.parent.parent.datagram.datagram_process(frame, self.address)
+
+    def send(self, message_index, packet, future):
+        def forget(_):
+            if self.in_flight.get(message_index) is future:
+                del self.in_flight[message_index]
+
+        self.in_flight[message_index] = future
+        future.add_done_callback(forget)
+        self.last_used = time.monotonic()
+        self.transport.write(packet)
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+class RSConnectionPool:
+
+    # one connection per device address, opened on first use and kept open. a connection that can't be opened
+    # is retried after a backoff doubling up to max_backoff, one left idle for idle_timeout seconds is closed
+    def __init__(self, parent, connect_timeout=2, idle_timeout=60, min_backoff=0.5, max_backoff=30):
+        self.parent = parent
+        self.connect_timeout = connect_timeout
+        self.idle_timeout = idle_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.connections = dict()
+        self.connecting = dict()
+        self.backoffs = dict()
+        self.eviction_task = None
+
+    def __len__(self):
+        return len(self.connections)
+
+    async def get(self, ip_address, port):
+        address = (ip_address, port)
+        connection = self.connections.get(address)
+        if connection is not None and not connection.is_closing():
+            return connection
+
+        # concurrent requests share the connection being opened
+        future = self.connecting.get(address)
+        if future is None:
+            retry_time, _ = self.backoffs.get(address, (0, 0))
+            if time.monotonic() < retry_time:
+                raise RSTransportError('connection to {}:{} backing off'.format(*address))
+            future = self.connecting[address] = asyncio.ensure_future(self.connect(address))
+            future.add_done_callback(retrieve_exception)
+        return await asyncio.shield(future)
+
+    async def connect(self, address):
+        loop = asyncio.get_event_loop()
+        try:
+            _, connection = await asyncio.wait_for(
+                loop.create_connection(lambda: RSStreamConnection(self, address), *address), self.connect_timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            _, backoff = self.backoffs.get(address, (0, 0))
+            backoff = min(max(backoff * 2, self.min_backoff), self.max_backoff)
+            self.backoffs[address] = (time.monotonic() + backoff, backoff)
+            self.parent.metrics.connection_failures += 1
+            raise RSTransportError('connection to {}:{} failed'.format(*address)) from e
+        finally:
+            del self.connecting[address]
+
+        self.backoffs.pop(address, None)
+        self.connections[address] = connection
+        self.parent.metrics.connections_opened += 1
+        if self.idle_timeout and self.eviction_task is None:
+            self.eviction_task = asyncio.ensure_future(self.eviction_loop())
+        return connection
+
+    def remove(self, connection):
+        if self.connections.get(connection.address) is connection:
+            del self.connections[connection.address]
+            self.parent.metrics.connections_closed += 1
+
+    async def send_packet(self, message_index, packet, ip_address, port, binary_mac_address, timeout=None):
+        connection = await self.get(ip_address, port)
+        future = self.parent.datagram.expect(message_index, binary_mac_address, timeout)
+        if not future.done():
+            connection.send(message_index, packet, future)
+        return await future
+
+    async def eviction_loop(self):
+        try:
+            while self.connections:
+                await asyncio.sleep(self.idle_timeout / 2)
+                now = time.monotonic()
+                for connection in list(self.connections.values()):
+                    if not connection.in_flight and now - connection.last_used > self.idle_timeout:
+                        connection.close()
+        finally:
+            self.eviction_task = None
+
+    def close(self):
+        if self.eviction_task is not None:
+            self.eviction_task.cancel()
+        for connection in list(self.connections.values()):
+            connection.close()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- Mode: Python; tab-width: 4 -*-
+#
+# pyrecswitch - interface for controlling Ankuoo RecSwitch MS6126
+# Copyright (C) 2018 Marco Lertora <marco.lertora@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import inspect
+from collections import deque
+
+from .metrics import RSMetrics
+
+
+class RSDispatcher:
+    overflow_policies = ('drop_oldest', 'drop_newest')
+
+    # runs user callbacks off the receive path, one worker task drains a bounded queue
+    def __init__(self, maxsize=1024, overflow='drop_oldest', metrics=None):
+        if overflow not in self.overflow_policies:
+            raise ValueError('invalid overflow policy, {}'.format(', '.join(self.overflow_policies)))
+
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.metrics = metrics if metrics else RSMetrics()
+        self.queue = deque()
+        self.task = None
+
+    def __len__(self):
+        return len(self.queue)
+
+    def dispatch(self, callback, *args):
+        if len(self.queue) >= self.maxsize:
+            self.metrics.callbacks_dropped += 1
+            if self.overflow == 'drop_newest':
+                return False
+            self.queue.popleft()
+
+        self.queue.append((callback, args))
+        self.metrics.dispatch_queue_depth = len(self.queue)
+
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+        return True
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while self.queue:
+            callback, args = self.queue.popleft()
+            self.metrics.dispatch_queue_depth = len(self.queue)
+            try:
+                ret = callback(*args)
+                if inspect.isawaitable(ret):
+                    await ret
+                self.metrics.callbacks_dispatched += 1
+            except Exception as e:
+                self.metrics.callback_errors += 1
+                loop.call_exception_handler({'message': 'callback {!r} failed'.format(callback), 'exception': e})
+
+    def close(self):
+        self.queue.clear()
+        self.metrics.dispatch_queue_depth = 0
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- Mode: Python; tab-width: 4 -*-
+#
+# pyrecswitch - interface for controlling Ankuoo RecSwitch MS6126
+# Copyright (C) 2018 Marco Lertora <marco.lertora@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+from collections import deque
+from weakref import WeakSet, finalize
+
+from .helpers import pack_mac_address
+
+
+class RSSubscription:
+    overflow_policies = ('drop_oldest', 'block')
+
+    # async iterator over the events of one subscriber, with its own bounded buffer.
+    # 'drop_oldest' discards the oldest event when the buffer is full, 'block' pauses reading from the network
+    # until the subscriber catches up, responses to requests wait as well
+    def __init__(self, parent, commands=None, mac_addresses=None, maxsize=256, overflow='drop_oldest'):
+        if overflow not in self.overflow_policies:
+            raise ValueError('invalid overflow policy, {}'.format(', '.join(self.overflow_policies)))
+
+        self.parent = parent
+        self.commands = frozenset(commands) if commands else None
+        self.mac_addresses = frozenset(map(pack_mac_address, mac_addresses)) if mac_addresses else None
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.queue = deque()
+        self.waiter = None
+        self.dropped = 0
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.queue:
+            if self.closed:
+                raise StopAsyncIteration
+            self.waiter = asyncio.get_event_loop().create_future()
+            try:
+                await self.waiter
+            finally:
+                self.waiter = None
+
+        event = self.queue.popleft()
+        if self.overflow == 'block':
+            self.parent.resume()
+        return event
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def is_full(self):
+        return len(self.queue) >= self.maxsize
+
+    def accepts(self, event):
+        if self.commands is not None and event.command not in self.commands:
+            return False
+        if self.mac_addresses is not None and event.device_config.binary_mac_address not in self.mac_addresses:
+            return False
+        return True
+
+    def put(self, event):
+        if self.overflow == 'drop_oldest' and self.is_full():
+            self.queue.popleft()
+            self.dropped += 1
+
+        self.queue.append(event)
+        if self.overflow == 'block' and self.is_full():
+            # the following datagrams wait in the socket buffer, or in the transport for the rest of a batch
+            self.parent.pause()
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def close(self):
+        # the events already buffered can still be consumed
+        if self.closed:
+            return
+        self.closed = True
+        self.parent.unsubscribe(self)
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+
+class RSEventBus:
+
+    # fans the events of a network out to the subscribers, a subscription dropped without close() goes away
+    # with its last reference
+    def __init__(self, parent):
+        self.parent = parent
+        self.subscriptions = WeakSet()
+        self.paused = False
+
+    def __len__(self):
+        return len(self.subscriptions)
+
+    def subscribe(self, commands=None, mac_addresses=None, maxsize=256, overflow='drop_oldest'):
+        subscription = RSSubscription(self, commands=commands, mac_addresses=mac_addresses, maxsize=maxsize,
+                                      overflow=overflow)
+        self.subscriptions.add(subscription)
+        if overflow == 'block':
+            # a blocking subscriber dropped while full must not keep the network paused
+            finalize(subscription, asyncio.get_event_loop().call_soon, self.resume)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscriptions.discard(subscription)
+        if subscription.overflow == 'block':
+            self.resume()
+
+    def publish(self, event):
+        for subscription in list(self.subscriptions):
+            if subscription.accepts(event):
+                subscription.put(event)
+
+    def pause(self):
+        transport = self.parent.datagram.transport
+        if not self.paused and transport is not None and hasattr(transport, 'pause_reading'):
+            self.paused = True
+            transport.pause_reading()
+
+    def resume(self):
+        if not self.paused:
+            return
+        for subscription in self.subscriptions:
+            if subscription.overflow == 'block' and subscription.is_full():
+                return
+
+        self.paused = False
+        transport = self.parent.datagram.transport
+        if transport is not None and not transport.is_closing():
+            transport.resume_reading()
+
+    def close(self):
+        for subscription in list(self.subscriptions):
+            subscription.close()
@@ -34,6 +34,10 @@ class RSTimeoutError(RSNetworkError):
     pass
 
 
+class RSDeviceUnavailableError(RSNetworkError):
+    pass
+
+
 
 
 
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- Mode: Python; tab-width: 4 -*-
+#
+# pyrecswitch - interface for controlling Ankuoo RecSwitch MS6126
+# Copyright (C) 2018 Marco Lertora <marco.lertora@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+
+
+class RSRoundTripEstimator:
+    __slots__ = ('min_timeout', 'max_timeout', 'smoothed_rtt', 'rtt_variance', 'timeout')
+    # smoothing factors and variance multiplier as in RFC 6298
+    alpha = 1 / 8
+    beta = 1 / 4
+    k = 4
+
+    def __init__(self, initial_timeout=1, min_timeout=0.2, max_timeout=5):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.smoothed_rtt = None
+        self.rtt_variance = None
+        self.timeout = min(initial_timeout, max_timeout)
+
+    def sample(self, rtt):
+        if self.smoothed_rtt is None:
+            self.smoothed_rtt = rtt
+            self.rtt_variance = rtt / 2
+        else:
+            self.rtt_variance = (1 - self.beta) * self.rtt_variance + self.beta * abs(self.smoothed_rtt - rtt)
+            self.smoothed_rtt = (1 - self.alpha) * self.smoothed_rtt + self.alpha * rtt
+
+        timeout = self.smoothed_rtt + self.k * self.rtt_variance
+        self.timeout = min(max(timeout, self.min_timeout), self.max_timeout)
+
+    def backoff(self, timeout):
+        return min(timeout * 2, self.max_timeout)
+
+
+class RSCircuitBreaker:
+    __slots__ = ('failure_threshold', 'probe_interval', 'failures', 'next_probe')
+
+    # after failure_threshold consecutive timeouts the device is considered down, requests fail
+    # immediately except for one probe every probe_interval seconds
+    def __init__(self, failure_threshold=3, probe_interval=10):
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.failures = 0
+        self.next_probe = None
+
+    def is_open(self):
+        return self.next_probe is not None
+
+    def allow(self):
+        if self.next_probe is None:
+            return True
+
+        now = time.monotonic()
+        if now < self.next_probe:
+            return False
+
+        self.next_probe = now + self.probe_interval
+        return True
+
+    def success(self):
+        self.failures = 0
+        self.next_probe = None
+
+    def failure(self):
+        self.failures += 1
+        if self.failure_threshold and self.failures >= self.failure_threshold and self.next_probe is None:
+            self.next_probe = time.monotonic() + self.probe_interval
@@ -18,9 +18,41 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+from .constants import RSCommand, RSHeaderFlag
+
+
 def unpack_mac_address(mac_address):
     return ':'.join(map(lambda x: '{:02X}'.format(x), mac_address))
 
 
 def pack_mac_address(mac_address):
     return bytes(map(lambda x: int(x, 16), mac_address.split(':')))
+
+
+def normalize_mac_address(mac_address):
+    return unpack_mac_address(pack_mac_address(mac_address))
+
+
+# shared futures may outlive all of their callers, don't let their exception be reported as never retrieved
+def retrieve_exception(future):
+    if not future.cancelled():
+        future.exception()
+
+
+def is_reply(binary_mac_address, header, message_index, in_flight):
+    # the response to one of our requests: a reback from the device the request went to. in_flight maps our message
+    # indexes to (binary mac address, future), the requests of other controllers sharing the port may reuse them
+    if not header.flag & RSHeaderFlag.reback:
+        return False
+    entry = in_flight.get(message_index)
+    return entry is not None and entry[0] == binary_mac_address
+
+
+def moved_ip_address(ip_address, remote_address, command, reply):
+    # the new ip address of a device, a dhcp renewal for instance, or None. only a report or the reply to one of our
+    # requests tells where the device is, requests of other controllers and spoofed packets may come from anywhere
+    if not remote_address or remote_address[0] == ip_address:
+        return None
+    if command == RSCommand.REPORT_GPIO_CHANGE or reply:
+        return remote_address[0]
+    return None
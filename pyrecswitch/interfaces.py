@@ -18,20 +18,37 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import asyncio
-
-from .constants import RSCommand
-from .exceptions import RSTimeoutError, RSTransportError, RSNetworkError
+import time
+
+from .allocators import RSMessageIndexAllocator
+from .captures import RSCaptureWriter
+from .connections import RSConnectionPool
+from .dispatchers import RSDispatcher
+from .events import RSEventBus
+from .constants import RSCommand, RSHeaderFlag
+from .exceptions import RSTimeoutError, RSTransportError, RSNetworkError, RSDeviceUnavailableError, RSInvalidMessage
+from .health import RSRoundTripEstimator, RSCircuitBreaker
+from .helpers import is_reply, moved_ip_address, pack_mac_address, retrieve_exception
+from .limiters import RSRateLimiter
 from .messages import RSMessages
-from .structures import RSDeviceConfig
+from .metrics import RSMetrics, render_prometheus
+from .schedulers import RSHeartBeatScheduler, RSActionScheduler
+from .snapshots import RSSnapshot, RSSnapshotEntry
+from .structures import RSDeviceConfig, GPIOStatus, RSEvent
+from .timers import RSTimerWheel
+from .transports import create_batched_datagram_endpoint
 
 
 class RSProtocol(asyncio.DatagramProtocol):
 
-    def __init__(self, parent, timeout_interval=5):
+    def __init__(self, parent, timeout_interval=5, max_in_flight=None, timeout_granularity=0.1):
         self.parent = parent
         self.transport = None
         self.messages = dict()
+        self.message_indexes = RSMessageIndexAllocator(window=max_in_flight)
         self.timeout_interval = timeout_interval
+        self.timeouts = RSTimerWheel(granularity=timeout_granularity)
+        self.capture = None
 
     def connection_made(self, transport):
         self.transport = transport
@@ -40,98 +57,515 @@ class RSProtocol(asyncio.DatagramProtocol):
         return self.transport is not None
 
     def datagram_received(self, datagram, remote_address):
-        asyncio.ensure_future(self.datagram_process(datagram))
+        self.datagram_process(datagram, remote_address)
+
+    def datagrams_received(self, datagrams):
+        # the batch is parsed in one call, the payloads sharing a cipher are decrypted together. a full blocking
+        # subscriber stops it, the transport keeps the datagrams not processed
+        messages = RSMessages.parse_messages([datagram for datagram, _ in datagrams], ignore_invalid=True,
+                                             aligned=True, with_header=True)
+        for position, ((datagram, remote_address), message) in enumerate(zip(datagrams, messages)):
+            self.message_process(datagram, remote_address, message)
+            if self.parent.event_bus.paused:
+                return position + 1
+        return len(datagrams)
+
+    def datagram_process(self, datagram, remote_address=None):
+        try:
+            message = RSMessages.parse_message(datagram, with_header=True)
+        except RSInvalidMessage:
+            message = None
+        self.message_process(datagram, remote_address, message)
 
-    async def datagram_process(self, datagram):
-        device_config, message_index, command, response = RSMessages.parse_message(datagram)
+    # responses resolve their future right here, only user callbacks go through the dispatcher
+    def message_process(self, datagram, remote_address, message):
+        metrics = self.parent.metrics
+        metrics.datagrams_received += 1
 
-        if message_index in self.messages:
-            future, timeout = self.messages.pop(message_index)
-            future.set_result(response)
-            timeout.cancel()
+        if self.capture is not None:
+            self.capture.write(datagram, remote_address)
+
+        if message is None:
+            metrics.decode_failures += 1
             return
 
-        device = self.parent.devices.get(device_config.mac_address)
+        device_config, message_index, command, response, header = message
+
+        # routed by the mac address bytes of the header, never formatted
+        device = self.parent.devices_by_mac.get(device_config.binary_mac_address)
+        reply = is_reply(device_config.binary_mac_address, header, message_index, self.messages)
+
+        if device:
+            ip_address = moved_ip_address(device.ip_address, remote_address, command, reply)
+            if ip_address:
+                self.parent.update_device_address(device, ip_address)
+            # the requests of other controllers sharing the port carry no device state
+            if isinstance(response, GPIOStatus) and (command == RSCommand.REPORT_GPIO_CHANGE or
+                                                     header.flag & RSHeaderFlag.reback):
+                self.parent.update_gpio_status(device, response)
+
+        if self.parent.event_bus.subscriptions:
+            self.parent.event_bus.publish(RSEvent(device_config, command, response, time.monotonic()))
+
+        if reply:
+            _, future = self.messages.pop(message_index)
+            self.timeouts.cancel(message_index)
+            if not future.done():
+                future.set_result(response)
+            return
 
-        if command == RSCommand.REPORT_GPIO_CHANGE:
-            if device and device.report_gpio_change:
-                await device.report_gpio_change(response)
+        if command != RSCommand.REPORT_GPIO_CHANGE:
+            metrics.unknown_index_responses += 1
+            return
 
-    def timeout(self, message_index):
-        future, timeout = self.messages.pop(message_index)
-        future.set_exception(RSTimeoutError)
-        timeout.cancel()
+        metrics.broadcast_received()
+        if device:
+            device.metrics.broadcast_received()
+            if device.report_gpio_change:
+                self.parent.dispatcher.dispatch(device.report_gpio_change, response)
 
-    def send_packet(self, message_index, packet, ip_address, port):
-        loop = asyncio.get_event_loop()
-        future = loop.create_future()
-        if self.transport:
-            self.transport.sendto(packet, (ip_address, port))
-            timeout = loop.call_later(self.timeout_interval, self.timeout, message_index)
-            self.messages[message_index] = (future, timeout)
+    def timeout(self, message_index):
+        _, future = self.messages.pop(message_index)
+        if not future.done():
+            future.set_exception(RSTimeoutError)
+
+    def fail(self, message_index, exc):
+        _, future = self.messages.pop(message_index)
+        self.timeouts.cancel(message_index)
+        if not future.done():
+            future.set_exception(exc)
+
+    def expect(self, message_index, binary_mac_address, timeout=None):
+        # the future of the response of this device with this index, whichever transport the request went through
+        timeout = timeout if timeout else self.timeout_interval
+        future = asyncio.get_event_loop().create_future()
+        if message_index in self.messages:
+            future.set_exception(RSNetworkError('message index {} already in flight'.format(message_index)))
         else:
+            self.timeouts.schedule(message_index, timeout, self.timeout, message_index)
+            self.messages[message_index] = (binary_mac_address, future)
+        return future
+
+    def send_packet(self, message_index, packet, ip_address, port, binary_mac_address, timeout=None):
+        if not self.transport:
+            future = asyncio.get_event_loop().create_future()
             future.set_exception(RSTransportError)
+            return future
+
+        future = self.expect(message_index, binary_mac_address, timeout)
+        if not future.done():
+            self.transport.sendto(packet, (ip_address, port))
         return future
 
+    def close(self):
+        # the requests in flight won't get an answer
+        self.timeouts.close()
+        messages, self.messages = self.messages, dict()
+        for _, future in messages.values():
+            if not future.done():
+                future.set_exception(RSTransportError('network closed'))
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
 
 class RSDevice:
+    transports = ('udp', 'tcp')
+
+    def __init__(self, parent, mac_address, ip_address, port=None, start_heart_beat_loop=True, retransmissions=0,
+                 transport='udp', tcp_port=None, send_rate=None, send_burst=None):
+        if transport not in self.transports:
+            raise ValueError('invalid transport, {}'.format(', '.join(self.transports)))
 
-    def __init__(self, parent, mac_address, ip_address, port=None, start_heart_beat_loop=True):
         self.parent = parent
         self.port = port if port else RSDeviceConfig.default_udp_port
+        self.transport = transport
+        self.tcp_port = tcp_port if tcp_port else RSDeviceConfig.default_tcp_port
         self.ip_address = ip_address
-        self.device_config = RSDeviceConfig(mac_address)
+        self.device_config = RSDeviceConfig.intern(mac_address)
         self.heart_beat_interval = 15
+        self.module_info = None
         self.report_gpio_change = None
+        self.retransmissions = retransmissions
+        self.round_trip = RSRoundTripEstimator(max_timeout=parent.datagram.timeout_interval)
+        self.circuit_breaker = RSCircuitBreaker()
+        self.metrics = RSMetrics(histograms=parent.device_histograms)
+        self.send_bucket = parent.limiter.device_bucket(send_rate, send_burst)
+        self.pending_reads = dict()
+        self.pending_write = None
+        self.write_task = None
 
         if start_heart_beat_loop:
-            asyncio.ensure_future(self.heart_beat_loop())
+            parent.heart_beats.add(self)
 
     async def heart_beat_loop(self):
-        try:
-            ret = await self.heart_beat()
-            interval = ret.interval
-        except RSNetworkError:
-            interval = self.heart_beat_interval
-
-        await asyncio.sleep(interval)
-        await self.heart_beat_loop()
+        # the network scheduler sends the heart beats, a device is never beaten twice
+        if self not in self.parent.heart_beats:
+            self.parent.heart_beats.add(self)
 
     async def heart_beat(self):
-        return await self.send_packet(*RSMessages.heart_beat(self.device_config))
+        return await self.send_request(RSCommand.HEART_BEAT, RSMessages.heart_beat)
 
     async def query_module_info(self):
-        return await self.send_packet(*RSMessages.query_module_info(self.device_config))
+        self.module_info = await self.send_read_request(RSCommand.QUERY_MODULE_INFO, RSMessages.query_module_info)
+        return self.module_info
+
+    async def refresh(self):
+        # the state restored from a snapshot, module info changes with the firmware only
+        await self.get_gpio_status()
+        if self.module_info is None:
+            await self.query_module_info()
+
+    async def get_gpio_status(self, max_age=None):
+        if max_age is not None:
+            ret = self.parent.get_cached_gpio_status(self, max_age)
+            if ret is not None:
+                return ret
 
-    async def get_gpio_status(self):
-        return await self.send_packet(*RSMessages.get_gpio_status(self.device_config, flag=0))
+        return await self.send_read_request(RSCommand.GET_GPIO_STATUS, RSMessages.get_gpio_status, flag=0)
 
     async def set_gpio_status(self, state):
-        return await self.send_packet(*RSMessages.set_gpio_status(self.device_config, flag=0, state=state))
+        # writes queued behind the one in flight collapse, only the latest state is sent
+        if self.pending_write is None:
+            future = asyncio.get_event_loop().create_future()
+            future.add_done_callback(retrieve_exception)
+            self.pending_write = [future, state]
+        else:
+            self.pending_write[1] = state
+
+        future = self.pending_write[0]
+        if self.write_task is None:
+            self.write_task = asyncio.ensure_future(self.write_loop())
+        return await asyncio.shield(future)
 
-    def send_packet(self, message_index, packet):
-        return self.parent.datagram.send_packet(message_index, packet, self.ip_address, self.port)
+    async def write_loop(self):
+        try:
+            while self.pending_write:
+                future, state = self.pending_write
+                self.pending_write = None
+                try:
+                    ret = await self.send_request(RSCommand.SET_GPIO_STATUS, RSMessages.set_gpio_status, flag=0,
+                                                 state=state)
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+                except Exception as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(ret)
+        finally:
+            self.write_task = None
+
+    async def send_read_request(self, command, build_message, **kwargs):
+        # concurrent identical reads share the request in flight
+        future = self.pending_reads.get(command)
+        if future is None:
+            future = asyncio.ensure_future(self.send_request(command, build_message, **kwargs))
+            future.add_done_callback(lambda _: self.pending_reads.pop(command, None))
+            future.add_done_callback(retrieve_exception)
+            self.pending_reads[command] = future
+        return await asyncio.shield(future)
+
+    async def send_request(self, command, build_message, **kwargs):
+        if not self.circuit_breaker.allow():
+            self.record('request_rejected')
+            raise RSDeviceUnavailableError(self.device_config.mac_address)
+
+        message_indexes = self.parent.datagram.message_indexes
+        message_index = await message_indexes.acquire()
+        try:
+            message_index, packet = build_message(self.device_config, message_index=message_index, **kwargs)
+            return await self.transmit(command, message_index, packet)
+        finally:
+            message_indexes.release(message_index)
+
+    def record(self, event, *args):
+        getattr(self.metrics, event)(*args)
+        getattr(self.parent.metrics, event)(*args)
+
+    async def transmit(self, command, message_index, packet):
+        loop = asyncio.get_event_loop()
+        # a stream delivers or fails by itself, retransmissions are for datagrams only
+        retransmissions = self.retransmissions if self.transport == 'udp' else 0
+        # without retransmissions keep the protocol timeout, a single try shouldn't give up early
+        timeout = self.round_trip.timeout if retransmissions else None
+        start_time = loop.time()
+        self.record('request_started')
+
+        for attempt in range(retransmissions + 1):
+            try:
+                waiter = self.parent.limiter.acquire(self, command)
+                if waiter is not None:
+                    await waiter
+                sent_time = loop.time()
+                ret = await self.send_packet(message_index, packet, timeout=timeout)
+            except RSTimeoutError:
+                if attempt < retransmissions:
+                    self.metrics.retransmissions += 1
+                    self.parent.metrics.retransmissions += 1
+                    timeout = self.round_trip.backoff(timeout)
+                    continue
+                self.record('request_timed_out', command)
+                self.circuit_breaker.failure()
+                raise
+            except BaseException as e:
+                self.record('request_failed', e)
+                raise
+
+            # a response to a retransmitted packet is ambiguous, skip it as rtt sample (karn's algorithm)
+            if attempt == 0:
+                self.round_trip.sample(loop.time() - sent_time)
+            self.record('request_completed', command, loop.time() - start_time)
+            self.circuit_breaker.success()
+            return ret
+
+    def send_packet(self, message_index, packet, timeout=None):
+        binary_mac_address = self.device_config.binary_mac_address
+        if self.transport == 'tcp':
+            return self.parent.connections.send_packet(message_index, packet, self.ip_address, self.tcp_port,
+                                                       binary_mac_address, timeout=timeout)
+        return self.parent.datagram.send_packet(message_index, packet, self.ip_address, self.port, binary_mac_address,
+                                                timeout=timeout)
+
+    def events(self, commands=None, maxsize=256, overflow='drop_oldest'):
+        return self.parent.events(commands=commands, mac_addresses=(self.device_config.mac_address,),
+                                  maxsize=maxsize, overflow=overflow)
 
 
 class RSNetwork:
 
-    def __init__(self):
+    def __init__(self, max_in_flight=None, timeout_granularity=0.1, heart_beat_rate=100, dispatch_queue_size=1024,
+                 dispatch_overflow='drop_oldest', send_rate=None, send_burst=None, device_send_rate=None,
+                 device_send_burst=None, device_histograms=False):
+        # the latency histograms are kept for the network, per device only if asked, they take 2 KB each
+        self.device_histograms = device_histograms
         self.devices = dict()
-        self.datagram = RSProtocol(self)
-
-    def create_datagram_endpoint(self, loop=None, local_ip_address=None, local_port=None):
+        self.devices_by_mac = dict()
+        self.devices_by_address = dict()
+        self.datagram = RSProtocol(self, max_in_flight=max_in_flight, timeout_granularity=timeout_granularity)
+        self.heart_beats = RSHeartBeatScheduler(self, max_rate=heart_beat_rate)
+        self.actions = RSActionScheduler(self)
+        self.connections = RSConnectionPool(self)
+        self.gpio_status_cache = dict()
+        self.metrics = RSMetrics()
+        self.dispatcher = RSDispatcher(maxsize=dispatch_queue_size, overflow=dispatch_overflow, metrics=self.metrics)
+        # packets per second sent by the whole network and by each device, unlimited by default
+        self.limiter = RSRateLimiter(rate=send_rate, burst=send_burst, device_rate=device_send_rate,
+                                     device_burst=device_send_burst, metrics=self.metrics)
+        self.event_bus = RSEventBus(self)
+        self.refresh_task = None
+
+    def create_datagram_endpoint(self, loop=None, local_ip_address=None, local_port=None, batched=False, max_batch=64,
+                                 receive_buffer_size=None):
         loop = loop if loop else asyncio.get_event_loop()
         local_ip_address = local_ip_address if local_ip_address else '0.0.0.0'
-        local_port = local_port if local_port else RSDeviceConfig.default_udp_port
+        local_port = local_port if local_port is not None else RSDeviceConfig.default_udp_port
+        if batched:
+            # needs a selector based event loop
+            return create_batched_datagram_endpoint(loop, self.datagram, (local_ip_address, local_port),
+                                                    max_batch=max_batch, receive_buffer_size=receive_buffer_size)
         return loop.create_datagram_endpoint(lambda: self.datagram, local_addr=(local_ip_address, local_port))
 
-    def register_device(self, mac_address, ip_address):
-        device = RSDevice(self, mac_address, ip_address)
-        self.devices[mac_address] = device
+    def register_device(self, mac_address, ip_address, port=None, retransmissions=0, heart_beat=True, transport='udp',
+                        tcp_port=None, send_rate=None, send_burst=None):
+        # transport 'tcp' sends the requests over a pooled connection to tcp_port, the reports still come by udp
+        binary_mac_address = pack_mac_address(mac_address)
+        if binary_mac_address in self.devices_by_mac:
+            self.unregister_device(mac_address)
+
+        device = RSDevice(self, mac_address, ip_address, port=port, retransmissions=retransmissions,
+                          start_heart_beat_loop=heart_beat, transport=transport, tcp_port=tcp_port,
+                          send_rate=send_rate, send_burst=send_burst)
+        # the devices are keyed by the normalized mac address, upper case
+        self.devices[device.device_config.mac_address] = device
+        self.devices_by_mac[device.device_config.binary_mac_address] = device
+        self.devices_by_address[(device.ip_address, device.port)] = device
         return device
 
     def unregister_device(self, mac_address):
-        del self.devices[mac_address]
+        try:
+            device = self.devices_by_mac.pop(pack_mac_address(mac_address))
+        except (KeyError, ValueError):
+            raise KeyError(mac_address) from None
+        del self.devices[device.device_config.mac_address]
+        if self.devices_by_address.get((device.ip_address, device.port)) is device:
+            del self.devices_by_address[(device.ip_address, device.port)]
+        self.heart_beats.remove(device)
+        self.gpio_status_cache.pop(device, None)
 
     def get_device(self, mac_address):
-        return self.devices[mac_address]
+        # a miss names the mac address as given, not its packed bytes
+        try:
+            return self.devices_by_mac[pack_mac_address(mac_address)]
+        except (KeyError, ValueError):
+            raise KeyError(mac_address) from None
+
+    def events(self, commands=None, mac_addresses=None, maxsize=256, overflow='drop_oldest'):
+        # every datagram received, responses included, as RSEvent
+        return self.event_bus.subscribe(commands=commands, mac_addresses=mac_addresses, maxsize=maxsize,
+                                        overflow=overflow)
+
+    def get_device_by_address(self, ip_address, port=None):
+        port = port if port else RSDeviceConfig.default_udp_port
+        return self.devices_by_address[(ip_address, port)]
+
+    def update_device_address(self, device, ip_address):
+        if self.devices_by_address.get((device.ip_address, device.port)) is device:
+            del self.devices_by_address[(device.ip_address, device.port)]
+        device.ip_address = ip_address
+        self.devices_by_address[(ip_address, device.port)] = device
+        device.metrics.address_changes += 1
+        self.metrics.address_changes += 1
+
+    def set_gpio_status_many(self, mac_addresses, state, concurrency=32, rate=None, stream=False):
+        return self.fan_out(mac_addresses, lambda device: device.set_gpio_status(state),
+                            concurrency=concurrency, rate=rate, stream=stream)
+
+    def get_gpio_status_many(self, mac_addresses, max_age=None, concurrency=32, rate=None, stream=False):
+        return self.fan_out(mac_addresses, lambda device: device.get_gpio_status(max_age=max_age),
+                            concurrency=concurrency, rate=rate, stream=stream)
+
+    def schedule_action(self, mac_address, state, at=None, delay=None, interval=None, misfire='fire_once', grace=1.0):
+        # set the relay at a unix time or after a delay, every interval seconds if given
+        return self.actions.add(mac_address, state, at=at, delay=delay, interval=interval, misfire=misfire,
+                                grace=grace)
+
+    def cancel_action(self, action_id):
+        return self.actions.remove(action_id)
+
+    def fan_out(self, mac_addresses, request, concurrency=32, rate=None, stream=False):
+        mac_addresses = list(mac_addresses)
+        results = self.iter_fan_out(mac_addresses, request, concurrency=concurrency, rate=rate)
+        return results if stream else self.collect_fan_out(mac_addresses, results)
+
+    @staticmethod
+    async def collect_fan_out(mac_addresses, results):
+        ret = dict.fromkeys(mac_addresses)
+        async for mac_address, result in results:
+            ret[mac_address] = result
+        return ret
+
+    async def iter_fan_out(self, mac_addresses, request, concurrency=32, rate=None):
+        # yields (mac_address, result) as requests complete, a failed request yields its exception
+        loop = asyncio.get_event_loop()
+        semaphore = asyncio.Semaphore(concurrency)
+        results = asyncio.Queue()
+        tasks = set()
+
+        async def execute(mac_address):
+            try:
+                ret = await request(self.get_device(mac_address))
+            except Exception as e:
+                ret = e
+            finally:
+                semaphore.release()
+            results.put_nowait((mac_address, ret))
+
+        async def launch():
+            next_start = loop.time()
+            for mac_address in mac_addresses:
+                await semaphore.acquire()
+                if rate:
+                    delay = next_start - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    next_start = max(next_start, loop.time()) + 1 / rate
+                task = asyncio.ensure_future(execute(mac_address))
+                task.add_done_callback(tasks.discard)
+                tasks.add(task)
+
+        launcher = asyncio.ensure_future(launch())
+        try:
+            for _ in range(len(mac_addresses)):
+                yield await results.get()
+        finally:
+            launcher.cancel()
+            for task in list(tasks):
+                task.cancel()
+
+    def start_capture(self, path):
+        # appends every datagram received to a capture file, see pyrecswitch.captures
+        self.stop_capture()
+        self.datagram.capture = RSCaptureWriter(path)
+        return self.datagram.capture
+
+    def stop_capture(self):
+        if self.datagram.capture is not None:
+            self.datagram.capture.close()
+            self.datagram.capture = None
+
+    def save_snapshot(self, path):
+        now = time.monotonic()
+        entries = list()
+        for device in self.devices.values():
+            received_time, gpio_status = self.gpio_status_cache.get(device, (None, None))
+            entries.append(RSSnapshotEntry(device.device_config.mac_address, device.ip_address, device.port,
+                                           device.heart_beat_interval, gpio_status,
+                                           now - received_time if received_time else None, device.module_info))
+        RSSnapshot.write(path, entries)
+
+    def load_snapshot(self, path, retransmissions=0, heart_beat=True, refresh_rate=10, refresh_concurrency=8):
+        # registers the devices with their last known state, usable right away, then refreshes them in background
+        devices = list()
+        now = time.monotonic()
+        with RSSnapshot(path) as snapshot:
+            # the state aged while the snapshot was on disk
+            offline_time = max(time.time() - snapshot.saved_time, 0)
+            for entry in snapshot:
+                device = self.register_device(entry.mac_address, entry.ip_address, port=entry.port,
+                                              retransmissions=retransmissions, heart_beat=heart_beat)
+                device.heart_beat_interval = entry.heart_beat_interval
+                device.module_info = entry.module_info
+                if entry.gpio_status is not None:
+                    self.update_gpio_status(device, entry.gpio_status, now - entry.gpio_age - offline_time)
+                devices.append(device)
+
+        if refresh_rate:
+            self.refresh_devices([device.device_config.mac_address for device in devices], rate=refresh_rate,
+                                 concurrency=refresh_concurrency)
+        return devices
+
+    def refresh_devices(self, mac_addresses, rate=10, concurrency=8):
+        if self.refresh_task is not None:
+            self.refresh_task.cancel()
+
+        async def refresh():
+            results = self.fan_out(mac_addresses, lambda device: device.refresh(), concurrency=concurrency,
+                                   rate=rate, stream=True)
+            async for _ in results:
+                pass
+
+        self.refresh_task = asyncio.ensure_future(refresh())
+        return self.refresh_task
+
+    def close(self):
+        # stops every background task, the pending schedule changes are written
+        if self.refresh_task is not None:
+            self.refresh_task.cancel()
+            self.refresh_task = None
+        self.heart_beats.close()
+        self.actions.close()
+        self.limiter.close()
+        self.connections.close()
+        self.dispatcher.close()
+        self.event_bus.close()
+        self.stop_capture()
+        self.datagram.close()
+
+    def export_metrics(self, per_device=False, prefix='pyrecswitch'):
+        families = dict()
+        self.metrics.collect(families, prefix=prefix)
+        if per_device:
+            for mac_address, device in self.devices.items():
+                device.metrics.collect(families, labels=dict(mac_address=mac_address), prefix=prefix + '_device')
+        return render_prometheus(families)
+
+    def update_gpio_status(self, device, gpio_status, received_time=None):
+        received_time = received_time if received_time is not None else time.monotonic()
+        self.gpio_status_cache[device] = (received_time, gpio_status)
+
+    def get_cached_gpio_status(self, device, max_age):
+        received_time, gpio_status = self.gpio_status_cache.get(device, (None, None))
+        if received_time is None or time.monotonic() - received_time > max_age:
+            return None
+        return gpio_status
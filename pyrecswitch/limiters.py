@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- Mode: Python; tab-width: 4 -*-
+#
+# pyrecswitch - interface for controlling Ankuoo RecSwitch MS6126
+# Copyright (C) 2018 Marco Lertora <marco.lertora@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import heapq
+
+from .constants import RSCommand
+from .exceptions import RSTransportError
+from .metrics import RSMetrics
+from .timers import RSTimerHeap
+
+
+class RSTokenBucket:
+    # the default burst, the tokens saved in this many seconds, absorbs timer resolution
+    burst_window = 0.1
+
+    # rate tokens per second, up to burst of them saved while idle
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst else max(1, rate * self.burst_window)
+        self.tokens = self.burst
+        self.last_time = None
+
+    def delay(self, now):
+        # seconds until a token is available
+        if self.last_time is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.last_time) * self.rate)
+        self.last_time = now
+        if self.tokens >= 1 - 1e-9:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class RSRateLimiter(RSTimerHeap):
+    # lower goes first, user commands then polls then heart beats
+    default_priorities = {
+        RSCommand.SET_GPIO_STATUS: 0,
+        RSCommand.GET_GPIO_STATUS: 1,
+        RSCommand.QUERY_MODULE_INFO: 1,
+        RSCommand.HEART_BEAT: 2,
+    }
+
+    # paces the packets sent by the whole network and by each device with token buckets. packets over the limit
+    # wait in a heap ordered by priority then arrival, a device out of tokens doesn't hold back the others
+    def __init__(self, rate=None, burst=None, device_rate=None, device_burst=None, priorities=None, metrics=None):
+        super().__init__()
+        self.bucket = RSTokenBucket(rate, burst) if rate else None
+        self.device_rate = device_rate
+        self.device_burst = device_burst
+        self.priorities = dict(priorities) if priorities else dict(self.default_priorities)
+        self.metrics = metrics if metrics else RSMetrics()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def device_bucket(self, rate=None, burst=None):
+        # the bucket of a device, the network wide defaults unless given
+        rate = rate if rate else self.device_rate
+        return RSTokenBucket(rate, burst if burst else self.device_burst) if rate else None
+
+    def acquire(self, device, command):
+        # None if the packet can be sent right away, otherwise a future done when it can
+        bucket = device.send_bucket
+        if self.bucket is None and bucket is None:
+            return None
+
+        loop = asyncio.get_event_loop()
+        if not self.queue and self.delay(bucket, loop.time()) == 0:
+            self.take(bucket)
+            return None
+
+        future = loop.create_future()
+        priority = self.priorities.get(command, max(self.priorities.values(), default=0))
+        self.metrics.requests_throttled += 1
+        device.metrics.requests_throttled += 1
+        # the heads of the queue may be waiting on their devices while this one could go now
+        self.push((priority, next(self.sequence), bucket, future))
+        self.wake()
+        self.metrics.send_queue_depth = len(self.queue)
+        return future
+
+    def delay(self, bucket, now):
+        delay = self.bucket.delay(now) if self.bucket is not None else 0
+        if bucket is not None:
+            delay = max(delay, bucket.delay(now))
+        return delay
+
+    def take(self, bucket):
+        if self.bucket is not None:
+            self.bucket.take()
+        if bucket is not None:
+            bucket.take()
+
+    def process(self):
+        return self.release(asyncio.get_event_loop().time())
+
+    def release(self, now):
+        # lets through the packets with tokens in priority order, returns the delay until the next one can go
+        deferred = list()
+        delay = None
+        while self.queue:
+            if self.bucket is not None:
+                network_delay = self.bucket.delay(now)
+                if network_delay:
+                    delay = min(delay, network_delay) if delay else network_delay
+                    break
+
+            entry = heapq.heappop(self.queue)
+            _, _, bucket, future = entry
+            # cancelled by the caller while waiting
+            if future.done():
+                continue
+
+            device_delay = bucket.delay(now) if bucket is not None else 0
+            if device_delay:
+                deferred.append(entry)
+                delay = min(delay, device_delay) if delay else device_delay
+                continue
+
+            self.take(bucket)
+            future.set_result(None)
+
+        for entry in deferred:
+            heapq.heappush(self.queue, entry)
+        self.metrics.send_queue_depth = len(self.queue)
+        return delay
+
+    def close(self):
+        queue = list(self.queue)
+        super().close()
+        for _, _, _, future in queue:
+            if not future.done():
+                future.set_exception(RSTransportError('rate limiter closed'))
+        self.metrics.send_queue_depth = 0
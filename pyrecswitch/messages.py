@@ -18,104 +18,256 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import struct
-from Crypto.Cipher import AES
 
+from .ciphers import RSCipher
 from .exceptions import RSInvalidMessage
 from .constants import RSConstants, RSHeaderFlag, RSCommand
-from .helpers import unpack_mac_address
-from .structures import GPIOStatus, HeartBeat, ModuleInfo, RSDeviceConfig
+from .structures import GPIOStatus, HeartBeat, ModuleInfo, RSDeviceConfig, RSHeader
+
+
+class RSFrameBuilder:
+    message_index_offset = 1
+
+    # everything but the message index and the message itself is constant for a device config
+    def __init__(self, device_config):
+        self.key = RSFrameBuilder.config_key(device_config)
+
+        flag = RSHeaderFlag.blank
+        self.cipher = None
+        if device_config.use_encryption:
+            flag |= RSHeaderFlag.encrypted
+            self.cipher = RSCipher.get(device_config.aes_key, device_config.aes_iv, device_config.cipher_backend)
+
+        self.header_prefix = struct.pack('!BB6s', RSConstants.SOCKET_HEADER_PV, flag,
+                                         device_config.binary_mac_address)
+        self.reback_header_prefix = struct.pack('!BB6s', RSConstants.SOCKET_HEADER_PV, flag | RSHeaderFlag.reback,
+                                                device_config.binary_mac_address)
+        self.payload_header = struct.pack(RSMessages.payload_header_format, RSConstants.SOCKET_HEADER_RESERVED, 0,
+                                          device_config.device_type, device_config.factory_code,
+                                          device_config.license_data)
+        self.padding = bytes([RSConstants.SOCKET_PAYLOAD_PADDING]) * RSMessages.default_payload_length
+
+    @staticmethod
+    def config_key(device_config):
+        return (device_config.binary_mac_address, device_config.device_type, device_config.factory_code,
+                device_config.license_data, device_config.use_encryption, device_config.aes_key,
+                device_config.aes_iv, device_config.cipher_backend)
+
+    def build(self, message_index, message, reback=False):
+        payload = bytearray(self.payload_header)
+        RSMessages.message_index_struct.pack_into(payload, self.message_index_offset, message_index)
+        payload += message
+        if len(payload) < RSMessages.default_payload_length:
+            payload += self.padding[len(payload):]
+
+        if self.cipher:
+            # responses may be longer than a block
+            payload += self.padding[:-len(payload) % RSCipher.block_size]
+            payload = self.cipher.encrypt(payload)
+
+        header_prefix = self.reback_header_prefix if reback else self.header_prefix
+        return header_prefix + bytes([len(payload)]) + payload
 
 
 class RSMessages:
     header_format = '!BB6sB'
-    header_length = struct.calcsize(header_format)
+    header_struct = struct.Struct(header_format)
+    header_length = header_struct.size
     payload_header_format = '!BHBBH'
+    payload_header_struct = struct.Struct(payload_header_format)
     message_command_format = '!B'
-    payload_header_length = struct.calcsize(payload_header_format)
+    payload_header_length = payload_header_struct.size
+    gpio_struct = struct.Struct('!BBBB')
+    heart_beat_struct = struct.Struct('!H')
+    gpio_commands = frozenset((RSCommand.SET_GPIO_STATUS, RSCommand.GET_GPIO_STATUS, RSCommand.REPORT_GPIO_CHANGE))
+    message_index_struct = struct.Struct('!H')
     default_payload_length = 16
 
     @staticmethod
-    def parse_message(data):
-        if len(data) < RSMessages.header_length:
-            raise RSInvalidMessage('invalid message length')
+    def frame_builder(device_config):
+        builder = device_config.frame_builder
+        if builder is None or builder.key != RSFrameBuilder.config_key(device_config):
+            builder = device_config.frame_builder = RSFrameBuilder(device_config)
+        return builder
 
-        pv, flag, mac_address, payload_length = struct.unpack_from(RSMessages.header_format, data)
+    @staticmethod
+    def parse_header(data):
+        view = memoryview(data)
+        if len(view) < RSMessages.header_length:
+            raise RSInvalidMessage('invalid message length')
 
-        device_config = RSDeviceConfig(unpack_mac_address(mac_address))
+        pv, flag, mac_address, payload_length = RSMessages.header_struct.unpack_from(view)
 
         if pv != RSConstants.SOCKET_HEADER_PV:
-            raise RSInvalidMessage('invalid message header', data.hex())
+            raise RSInvalidMessage('invalid message header', view.hex())
 
-        if len(data) < RSMessages.header_length + payload_length:
-            raise RSInvalidMessage('invalid message length', data.hex())
+        payload_end = RSMessages.header_length + payload_length
+        if len(view) < payload_end:
+            raise RSInvalidMessage('invalid message length', view.hex())
 
-        payload = data[RSMessages.header_length:RSMessages.header_length + payload_length]
+        # the mac address string is only formatted if someone asks for it
+        device_config = RSDeviceConfig.intern(binary_mac_address=mac_address)
+        payload = view[RSMessages.header_length:payload_end]
+        return view, device_config, flag, payload
 
-        if len(payload) != payload_length:
-            raise RSInvalidMessage('invalid message length', data.hex())
+    @staticmethod
+    def split_frames(buffer):
+        # a stream is cut into messages by the payload length of their header, the complete ones are removed
+        # from the buffer, a partial one is left for the next call
+        frames = list()
+        offset = 0
+        while len(buffer) - offset >= RSMessages.header_length:
+            if buffer[offset] != RSConstants.SOCKET_HEADER_PV:
+                raise RSInvalidMessage('invalid message header', bytes(buffer[offset:]).hex())
+            end = offset + RSMessages.header_length + buffer[offset + RSMessages.header_length - 1]
+            if end > len(buffer):
+                break
+            frames.append(bytes(buffer[offset:end]))
+            offset = end
+
+        del buffer[:offset]
+        return frames
 
-        if bool(flag & RSHeaderFlag.encrypted):
-            decipher = AES.new(device_config.aes_key, AES.MODE_CBC, device_config.aes_iv)
-            payload = decipher.decrypt(data[RSMessages.header_length:])
+    @staticmethod
+    def decipher(device_config):
+        return RSCipher.get(device_config.aes_key, device_config.aes_iv, device_config.cipher_backend)
 
-        (reserved,
-         message_index,
-         device_config.device_type,
-         device_config.factory_code,
-         device_config.license_data) = struct.unpack_from(RSMessages.payload_header_format, payload)
+    @staticmethod
+    def received_config(device_config, header):
+        # a config of its own carrying the header values received, the interned one builds the frames we send
+        received = RSDeviceConfig()
+        vars(received).update(vars(device_config))
+        vars(received).pop('frame_builder', None)
+        received.device_type = header.device_type
+        received.factory_code = header.factory_code
+        received.license_data = header.license_data
+        return received
+
+    @staticmethod
+    def parse_message(data, with_header=False):
+        # with_header returns the interned config and the received header values apart, as a fifth item
+        view, device_config, flag, payload = RSMessages.parse_header(data)
+
+        try:
+            if flag & RSHeaderFlag.encrypted:
+                payload = memoryview(RSMessages.decipher(device_config).decrypt(payload))
+
+            message_index, command, response, header = RSMessages.parse_payload(flag, payload)
+        except (struct.error, ValueError, IndexError) as e:
+            raise RSInvalidMessage('invalid message payload', view.hex()) from e
+
+        if with_header:
+            return device_config, message_index, command, response, header
+        return RSMessages.received_config(device_config, header), message_index, command, response
+
+    @staticmethod
+    def parse_payload(flag, payload):
+        reserved, message_index, device_type, factory_code, license_data = \
+            RSMessages.payload_header_struct.unpack_from(payload)
+
+        # the config is shared with the frames we send, the values received are returned apart
+        header = RSHeader(flag=flag, device_type=device_type, factory_code=factory_code, license_data=license_data)
 
-        message = payload[RSMessages.payload_header_length:]
-        command, = struct.unpack_from(RSMessages.message_command_format, message)
+        offset = RSMessages.payload_header_length
+        command = payload[offset]
+        offset += 1
 
         is_reback = bool(flag & RSHeaderFlag.reback)
 
-        if command in (RSCommand.SET_GPIO_STATUS, RSCommand.GET_GPIO_STATUS,
-                       RSCommand.REPORT_GPIO_CHANGE):
-            flag, fre, duty, res = struct.unpack_from('!BBBB', message, offset=1)
+        if command in RSMessages.gpio_commands:
+            flag, fre, duty, res = RSMessages.gpio_struct.unpack_from(payload, offset)
             state = duty == RSConstants.GPIO_FLAG_ON
-            return device_config, message_index, command, GPIOStatus(flag=flag, state=state)
+            return message_index, command, GPIOStatus(flag=flag, state=state), header
 
         if command == RSCommand.HEART_BEAT:
             if not is_reback:
-                return device_config, message_index, command, None
+                return message_index, command, None, header
 
-            interval, = struct.unpack_from('!H', message, offset=1)
-            return device_config, message_index, command, HeartBeat(interval=interval)
+            interval, = RSMessages.heart_beat_struct.unpack_from(payload, offset)
+            return message_index, command, HeartBeat(interval=interval), header
 
         if command == RSCommand.QUERY_MODULE_INFO:
             if not is_reback:
-                return device_config, message_index, command, None
-
-            offset = 1
-            response = ModuleInfo()
-            for index, name in enumerate(('hw_version', 'sw_version', 'device_name')):
-                length, = struct.unpack_from('!B', message, offset=offset)
-                value, = struct.unpack_from('!{}s'.format(length), message, offset=offset + 1)
+                return message_index, command, None, header
+
+            values = list()
+            for _ in range(3):
+                length = payload[offset]
+                value = payload[offset + 1:offset + 1 + length]
+                if len(value) != length:
+                    raise ValueError('truncated module info')
                 offset += length + 1
-                setattr(response, name, value.decode())
-                response.status, = struct.unpack_from('!B', message, offset=offset)
+                values.append(bytes(value).decode())
 
-            return device_config, message_index, command, response
+            hw_version, sw_version, device_name = values
+            response = ModuleInfo(hw_version=hw_version, sw_version=sw_version, device_name=device_name,
+                                  status=payload[offset])
+            return message_index, command, response, header
 
         raise RSInvalidMessage('unknown message type: {0:X}'.format(command))
 
     @staticmethod
-    def build_message(device_config, message_command, message_body=b''):
-        message_index = RSDeviceConfig.new_message_index()
-
-        message_prefix = struct.pack(RSMessages.message_command_format, message_command)
-        payload = RSMessages.build_payload(device_config, message_index, message_prefix + message_body)
+    def parse_messages(datagrams, ignore_invalid=False, aligned=False, with_header=False):
+        # the encrypted payloads sharing a cipher are decrypted with one call. aligned keeps one item per datagram,
+        # None for the invalid ones
+        headers = list()
+        batches = dict()
+        for data in datagrams:
+            try:
+                view, device_config, flag, payload = RSMessages.parse_header(data)
+                if flag & RSHeaderFlag.encrypted:
+                    if len(payload) % RSCipher.block_size:
+                        raise RSInvalidMessage('invalid message payload', view.hex())
+                    batch = batches.setdefault(RSMessages.decipher(device_config), list())
+                    batch.append(payload)
+                    payload = (batch, len(batch) - 1)
+            except RSInvalidMessage:
+                if not ignore_invalid:
+                    raise
+                if aligned:
+                    headers.append(None)
+                continue
+            headers.append((view, device_config, flag, payload))
+
+        decrypted = {id(batch): decipher.decrypt_many(batch) for decipher, batch in batches.items()}
+
+        messages = list()
+        for entry in headers:
+            if entry is None:
+                messages.append(None)
+                continue
+
+            view, device_config, flag, payload = entry
+            try:
+                if flag & RSHeaderFlag.encrypted:
+                    batch, position = payload
+                    payload = memoryview(decrypted[id(batch)][position])
+                message_index, command, response, header = RSMessages.parse_payload(flag, payload)
+            except (struct.error, ValueError, IndexError, RSInvalidMessage) as e:
+                if not ignore_invalid:
+                    if isinstance(e, RSInvalidMessage):
+                        raise
+                    raise RSInvalidMessage('invalid message payload', view.hex()) from e
+                if aligned:
+                    messages.append(None)
+                continue
+            if with_header:
+                messages.append((device_config, message_index, command, response, header))
+            else:
+                messages.append((RSMessages.received_config(device_config, header), message_index, command,
+                                 response))
+        return messages
 
-        flag = RSHeaderFlag.blank
-        if device_config.use_encryption:
-            flag |= RSHeaderFlag.encrypted
-            cipher = AES.new(device_config.aes_key, AES.MODE_CBC, device_config.aes_iv)
-            payload = cipher.encrypt(payload)
+    @staticmethod
+    def build_message(device_config, message_command, message_body=b'', message_index=None, reback=False):
+        if message_index is None:
+            message_index = RSDeviceConfig.new_message_index()
+        elif not RSDeviceConfig.min_message_index <= message_index <= RSDeviceConfig.max_message_index:
+            raise RSInvalidMessage('invalid message_index, {} - {}'.format(RSDeviceConfig.min_message_index,
+                                                                           RSDeviceConfig.max_message_index))
 
-        header_pv = RSConstants.SOCKET_HEADER_PV
-        mac_address = device_config.binary_mac_address
-        data = struct.pack(RSMessages.header_format, header_pv, flag, mac_address, len(payload))
-        return message_index, data + payload
+        builder = RSMessages.frame_builder(device_config)
+        return message_index, builder.build(message_index, bytes([message_command]) + message_body, reback)
 
     @staticmethod
     def build_payload(device_config, message_index, message):
@@ -131,27 +283,27 @@ class RSMessages:
         return data
 
     @staticmethod
-    def get_gpio_status(device_config, flag):
+    def get_gpio_status(device_config, flag, message_index=None):
         if not 0 <= flag <= 3:
             raise RSInvalidMessage('invalid flag, 0 - 3')
 
         message_command = RSCommand.GET_GPIO_STATUS
         message_body = struct.pack('!BBBB', flag, RSConstants.GPIO_FRE, RSConstants.GPIO_FLAG_OFF, RSConstants.GPIO_RES)
-        return RSMessages.build_message(device_config, message_command, message_body)
+        return RSMessages.build_message(device_config, message_command, message_body, message_index)
 
     @staticmethod
-    def set_gpio_status(device_config, flag, state):
+    def set_gpio_status(device_config, flag, state, message_index=None):
         message_command = RSCommand.SET_GPIO_STATUS
         state = RSConstants.GPIO_FLAG_ON if state else RSConstants.GPIO_FLAG_OFF
         message_body = struct.pack('!BBBB', flag, RSConstants.GPIO_FRE, state, RSConstants.GPIO_RES)
-        return RSMessages.build_message(device_config, message_command, message_body)
+        return RSMessages.build_message(device_config, message_command, message_body, message_index)
 
     @staticmethod
-    def heart_beat(device_config):
+    def heart_beat(device_config, message_index=None):
         message_command = RSCommand.HEART_BEAT
-        return RSMessages.build_message(device_config, message_command)
+        return RSMessages.build_message(device_config, message_command, message_index=message_index)
 
     @staticmethod
-    def query_module_info(device_config):
+    def query_module_info(device_config, message_index=None):
         message_command = RSCommand.QUERY_MODULE_INFO
-        return RSMessages.build_message(device_config, message_command)
+        return RSMessages.build_message(device_config, message_command, message_index=message_index)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- Mode: Python; tab-width: 4 -*-
+#
+# pyrecswitch - interface for controlling Ankuoo RecSwitch MS6126
+# Copyright (C) 2018 Marco Lertora <marco.lertora@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import math
+import time
+from bisect import bisect_left
+
+from .constants import RSCommand
+from .exceptions import RSTransportError
+
+
+class RSHistogram:
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(buckets) if buckets else self.default_buckets
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+    def quantile(self, fraction):
+        # upper bound of the bucket holding the quantile
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        for upper_bound, total in zip(self.buckets + (math.inf,), self.cumulative_counts()):
+            if total >= rank:
+                return upper_bound
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': dict(zip(self.buckets + (math.inf,), self.cumulative_counts())),
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+        }
+
+
+class RSRate:
+    __slots__ = ('time_constant', 'rate', 'last_time')
+
+    # exponentially decaying event rate, per second
+    def __init__(self, time_constant=10):
+        self.time_constant = time_constant
+        self.rate = 0.0
+        self.last_time = None
+
+    def mark(self, now=None):
+        now = now if now is not None else time.monotonic()
+        self.rate = self.value(now) + 1 / self.time_constant
+        self.last_time = now
+
+    def value(self, now=None):
+        if self.last_time is None:
+            return 0.0
+        now = now if now is not None else time.monotonic()
+        return self.rate * math.exp(-(now - self.last_time) / self.time_constant)
+
+
+class RSMetrics:
+    counter_names = ('requests', 'responses', 'timeouts', 'retransmissions', 'transport_errors',
+                     'unavailable_errors', 'unknown_index_responses', 'decode_failures', 'datagrams_received',
+                     'broadcasts_received', 'callbacks_dispatched', 'callbacks_dropped', 'callback_errors',
+                     'address_changes', 'connections_opened', 'connections_closed', 'connection_failures',
+                     'requests_throttled')
+
+    __slots__ = counter_names + ('histograms', 'latency', 'timeouts_by_command', 'broadcast_rate', 'in_flight',
+                                 'dispatch_queue_depth', 'send_queue_depth')
+
+    # fixed size, whatever the traffic the memory used doesn't grow. without histograms the latency isn't kept,
+    # the other counters are
+    def __init__(self, buckets=None, histograms=True):
+        self.histograms = histograms
+        self.latency = {command: RSHistogram(buckets) for command in RSCommand} if histograms else dict()
+        # filled on the first timeout of each command
+        self.timeouts_by_command = dict()
+        self.broadcast_rate = RSRate()
+        self.in_flight = 0
+        self.dispatch_queue_depth = 0
+        self.send_queue_depth = 0
+        for name in self.counter_names:
+            setattr(self, name, 0)
+
+    def request_started(self):
+        self.requests += 1
+        self.in_flight += 1
+
+    def request_completed(self, command, latency):
+        self.in_flight -= 1
+        self.responses += 1
+        if self.histograms:
+            self.latency[command].observe(latency)
+
+    def request_timed_out(self, command):
+        self.in_flight -= 1
+        self.timeouts += 1
+        self.timeouts_by_command[command] = self.timeouts_by_command.get(command, 0) + 1
+
+    def request_failed(self, error):
+        self.in_flight -= 1
+        if isinstance(error, RSTransportError):
+            self.transport_errors += 1
+
+    def request_rejected(self):
+        self.unavailable_errors += 1
+
+    def broadcast_received(self):
+        self.broadcasts_received += 1
+        self.broadcast_rate.mark()
+
+    def snapshot(self):
+        snapshot = {name: getattr(self, name) for name in self.counter_names}
+        snapshot['in_flight'] = self.in_flight
+        snapshot['dispatch_queue_depth'] = self.dispatch_queue_depth
+        snapshot['send_queue_depth'] = self.send_queue_depth
+        snapshot['broadcast_rate'] = self.broadcast_rate.value()
+        snapshot['timeouts_by_command'] = {command.name: self.timeouts_by_command.get(command, 0)
+                                           for command in RSCommand}
+        snapshot['latency'] = {command.name: histogram.snapshot() for command, histogram in self.latency.items()}
+        return snapshot
+
+    def collect(self, families, labels=None, prefix='pyrecswitch'):
+        labels = labels if labels else dict()
+
+        for name in self.counter_names:
+            add_sample(families, '{}_{}_total'.format(prefix, name), 'counter', labels, getattr(self, name))
+
+        add_sample(families, prefix + '_requests_in_flight', 'gauge', labels, self.in_flight)
+        add_sample(families, prefix + '_dispatch_queue_depth', 'gauge', labels, self.dispatch_queue_depth)
+        add_sample(families, prefix + '_send_queue_depth', 'gauge', labels, self.send_queue_depth)
+        add_sample(families, prefix + '_broadcast_rate', 'gauge', labels, self.broadcast_rate.value())
+
+        for command in RSCommand:
+            command_labels = dict(labels, command=command.name)
+            add_sample(families, prefix + '_command_timeouts_total', 'counter', command_labels,
+                       self.timeouts_by_command.get(command, 0))
+
+        name = prefix + '_request_duration_seconds'
+        for command, histogram in self.latency.items():
+            command_labels = dict(labels, command=command.name)
+            for upper_bound, total in zip(histogram.buckets + (math.inf,), histogram.cumulative_counts()):
+                bucket_labels = dict(command_labels, le=format_value(upper_bound))
+                add_sample(families, name, 'histogram', bucket_labels, total, suffix='_bucket')
+            add_sample(families, name, 'histogram', command_labels, histogram.sum, suffix='_sum')
+            add_sample(families, name, 'histogram', command_labels, histogram.count, suffix='_count')
+
+    def prometheus(self, labels=None, prefix='pyrecswitch'):
+        families = dict()
+        self.collect(families, labels, prefix)
+        return render_prometheus(families)
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def add_sample(families, name, metric_type, labels, value, suffix=''):
+    family = families.setdefault(name, (metric_type, list()))
+    family[1].append((name + suffix, labels, value))
+
+
+def render_prometheus(families):
+    lines = list()
+    for name, (metric_type, samples) in families.items():
+        lines.append('# TYPE {} {}'.format(name, metric_type))
+        for sample_name, labels, value in samples:
+            if labels:
+                label_text = ','.join('{}="{}"'.format(key, label) for key, label in labels.items())
+                sample_name = '{}{{{}}}'.format(sample_name, label_text)
+            lines.append('{} {}'.format(sample_name, format_value(value)))
+    return '\n'.join(lines) + '\n'
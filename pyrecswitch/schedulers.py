@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+# -*- Mode: Python; tab-width: 4 -*-
+#
+# pyrecswitch - interface for controlling Ankuoo RecSwitch MS6126
+# Copyright (C) 2018 Marco Lertora <marco.lertora@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+
+from .exceptions import RSNetworkError
+from .helpers import normalize_mac_address
+from .structures import RSRecord
+from .timers import RSTimerHeap
+
+logger = logging.getLogger(__name__)
+
+
+class RSHeartBeatScheduler(RSTimerHeap):
+    # how far the sender may fall behind before the rate budget is reset, absorbs timer resolution
+    burst_window = 0.1
+
+    # one task for the whole network, devices wait in a heap ordered by the time their heart beat is due
+    def __init__(self, parent, max_rate=100, jitter=0.1):
+        super().__init__()
+        self.parent = parent
+        self.max_rate = max_rate
+        self.jitter = jitter
+        self.scheduled = dict()
+        self.next_send = 0
+
+    def __len__(self):
+        return len(self.scheduled)
+
+    def __contains__(self, device):
+        return device in self.scheduled
+
+    def add(self, device, delay=None):
+        # spread devices registered together over their first interval
+        if delay is None:
+            delay = random.uniform(0, device.heart_beat_interval)
+        self.push(device, asyncio.get_event_loop().time() + delay)
+
+    def remove(self, device):
+        self.scheduled.pop(device, None)
+
+    def push(self, device, due):
+        sequence = next(self.sequence)
+        self.scheduled[device] = sequence
+        super().push((due, sequence, device))
+
+    def jittered(self, interval):
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def process(self):
+        loop = asyncio.get_event_loop()
+        while self.queue:
+            due, sequence, device = self.queue[0]
+            if self.scheduled.get(device) != sequence:
+                heapq.heappop(self.queue)
+                continue
+
+            delay = max(due, self.next_send) - loop.time()
+            if delay > 0:
+                return delay
+
+            heapq.heappop(self.queue)
+            self.scheduled[device] = None
+            asyncio.ensure_future(self.beat(device))
+            self.next_send = max(self.next_send, loop.time() - self.burst_window) + 1 / self.max_rate
+        return None
+
+    async def beat(self, device):
+        try:
+            ret = await device.heart_beat()
+            if ret and ret.interval:
+                # the interval the device asks for, kept for the snapshots and the next failure
+                device.heart_beat_interval = ret.interval
+            interval = device.heart_beat_interval
+        except RSNetworkError:
+            interval = device.heart_beat_interval
+
+        if device in self.scheduled:
+            self.push(device, asyncio.get_event_loop().time() + self.jittered(interval))
+
+    def close(self):
+        super().close()
+        self.scheduled.clear()
+
+
+class RSAction(RSRecord):
+    __slots__ = ('action_id', 'mac_address', 'state', 'due', 'interval', 'misfire', 'grace', 'last_run',
+                 'last_result')
+
+    def __init__(self, action_id=None, mac_address=None, state=None, due=None, interval=None, misfire='fire_once',
+                 grace=1.0, last_run=None, last_result=None):
+        self.action_id = action_id
+        self.mac_address = mac_address
+        self.state = state
+        self.due = due
+        self.interval = interval
+        self.misfire = misfire
+        self.grace = grace
+        self.last_run = last_run
+        self.last_result = last_result
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__ if name != 'last_result'}
+
+
+class RSActionScheduler(RSTimerHeap):
+    misfire_policies = ('fire_once', 'skip')
+
+    # one shot and recurring set_gpio_status actions in one heap, on wall clock time so they survive a restart.
+    # the actions due within the same tick go out as one batch, paced by concurrency and rate.
+    # an action later than its grace time, the loop stalled or the process was down, follows its misfire policy:
+    # 'fire_once' runs it once, 'skip' drops the missed run. a recurring action then resumes at its next future run.
+    # the schedule file is rewritten off the loop, at most every save_interval seconds whatever the changes
+    def __init__(self, parent, tick=0.1, concurrency=32, rate=None, path=None, save_interval=1.0):
+        super().__init__()
+        self.parent = parent
+        self.tick = tick
+        self.concurrency = concurrency
+        self.rate = rate
+        self.path = path
+        self.save_interval = save_interval
+        self.dirty = False
+        self.save_handle = None
+        self.save_future = None
+        self.save_lock = threading.Lock()
+        self.versions = itertools.count()
+        self.saved_version = -1
+        self.actions = dict()
+        self.scheduled = dict()
+        self.action_ids = itertools.count(1)
+        self.batches = set()
+
+    def __len__(self):
+        return len(self.actions)
+
+    def __contains__(self, action_id):
+        return action_id in self.actions
+
+    def add(self, mac_address, state, at=None, delay=None, interval=None, misfire='fire_once', grace=1.0):
+        if misfire not in self.misfire_policies:
+            raise ValueError('invalid misfire policy, {}'.format(', '.join(self.misfire_policies)))
+        if interval is not None and interval <= 0:
+            raise ValueError('invalid interval, {}'.format(interval))
+
+        due = at if at is not None else time.time() + (delay or 0)
+        action = RSAction(next(self.action_ids), normalize_mac_address(mac_address), bool(state), due,
+                          interval=interval, misfire=misfire, grace=grace)
+        self.actions[action.action_id] = action
+        self.push(action)
+        self.mark_dirty()
+        return action
+
+    def remove(self, action_id):
+        action = self.actions.pop(action_id)
+        self.scheduled.pop(action_id, None)
+        self.mark_dirty()
+        return action
+
+    def push(self, action):
+        sequence = next(self.sequence)
+        self.scheduled[action.action_id] = sequence
+        super().push((action.due, sequence, action.action_id))
+
+    def process(self):
+        while self.queue:
+            due, sequence, action_id = self.queue[0]
+            if self.scheduled.get(action_id) != sequence:
+                heapq.heappop(self.queue)
+                continue
+
+            delay = due - time.time()
+            if delay > 0:
+                return delay
+
+            # everything due within the tick joins the batch
+            now = time.time()
+            batch = list()
+            while self.queue and self.queue[0][0] <= now + self.tick:
+                due, sequence, action_id = heapq.heappop(self.queue)
+                if self.scheduled.get(action_id) != sequence:
+                    continue
+                action = self.actions[action_id]
+                if action.misfire == 'fire_once' or now - action.due <= action.grace:
+                    batch.append(action)
+                self.reschedule(action, now)
+
+            if batch:
+                task = asyncio.ensure_future(self.fire(batch))
+                task.add_done_callback(self.batches.discard)
+                self.batches.add(task)
+            self.mark_dirty()
+        return None
+
+    def reschedule(self, action, now):
+        if action.interval is None:
+            del self.actions[action.action_id]
+            del self.scheduled[action.action_id]
+            return
+
+        # the next run after now, the missed ones are not replayed
+        action.due += action.interval * max(1, math.ceil((now - action.due) / action.interval))
+        self.push(action)
+
+    async def fire(self, batch):
+        # the actions of a device in the same batch are merged, the last one due sets the state, all get the result
+        actions = dict()
+        for action in batch:
+            actions.setdefault(action.mac_address, list()).append(action)
+
+        results = self.parent.fan_out(actions, lambda device: device.set_gpio_status(
+            actions[device.device_config.mac_address][-1].state), concurrency=self.concurrency, rate=self.rate,
+                                      stream=True)
+        async for mac_address, result in results:
+            last_run = time.time()
+            for action in actions[mac_address]:
+                action.last_run = last_run
+                action.last_result = result
+
+    def mark_dirty(self):
+        if not self.path:
+            return
+        self.dirty = True
+        if self.save_handle is None:
+            self.save_handle = asyncio.get_event_loop().call_later(self.save_interval, self.flush)
+
+    def flush(self):
+        self.save_handle = None
+        if not self.dirty:
+            return
+
+        # one write at a time, the changes made meanwhile go in the next one
+        loop = asyncio.get_event_loop()
+        if self.save_future is not None and not self.save_future.done():
+            self.save_handle = loop.call_later(self.save_interval, self.flush)
+            return
+
+        self.dirty = False
+        self.save_future = loop.run_in_executor(None, self.write, self.path, self.dump(), next(self.versions))
+        self.save_future.add_done_callback(self.flushed)
+
+    def flushed(self, future):
+        if future.cancelled() or future.exception() is None:
+            return
+        logger.error('saving actions to %s failed', self.path, exc_info=future.exception())
+        self.mark_dirty()
+
+    def dump(self):
+        return [action.as_dict() for action in self.actions.values()]
+
+    def write(self, path, data, version):
+        with self.save_lock:
+            # a flush still running when save() is called must not overwrite the newer schedule
+            if path == self.path:
+                if version < self.saved_version:
+                    return
+                self.saved_version = version
+
+            temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+            with open(temporary_path, 'w') as fh:
+                json.dump(data, fh)
+            os.replace(temporary_path, path)
+
+    def save(self, path=None):
+        # writes right away, the changes waiting for the next flush included
+        path = path if path else self.path
+        if not path:
+            return
+
+        if path == self.path:
+            self.dirty = False
+        self.write(path, self.dump(), next(self.versions))
+
+    def load(self, path=None):
+        # the actions missed while the process was down follow their misfire policy on the first run
+        path = path if path else self.path
+        with open(path) as fh:
+            data = json.load(fh)
+
+        for values in data:
+            action = RSAction(**values)
+            self.actions[action.action_id] = action
+            self.push(action)
+        self.action_ids = itertools.count(max(self.actions, default=0) + 1)
+        return list(self.actions.values())
+
+    def close(self):
+        super().close()
+        for task in list(self.batches):
+            task.cancel()
+        if self.save_handle is not None:
+            self.save_handle.cancel()
+            self.save_handle = None
+        if self.dirty:
+            self.save()
+        self.scheduled.clear()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- Mode: Python; tab-width: 4 -*-
+#
+# pyrecswitch - interface for controlling Ankuoo RecSwitch MS6126
+# Copyright (C) 2018 Marco Lertora <marco.lertora@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import random
+import struct
+
+from .constants import RSCommand, RSConstants
+from .exceptions import RSInvalidMessage
+from .helpers import unpack_mac_address
+from .messages import RSMessages
+from .structures import RSDeviceConfig
+
+
+class RSSimulatedDevice:
+
+    def __init__(self, mac_address, state=False, heart_beat_interval=15, hw_version='HF-LPB100',
+                 sw_version='1.0.0', device_name='RecSwitch'):
+        self.device_config = RSDeviceConfig(mac_address)
+        self.state = state
+        self.heart_beat_interval = heart_beat_interval
+        self.hw_version = hw_version
+        self.sw_version = sw_version
+        self.device_name = device_name
+
+    def gpio_body(self, flag=0):
+        state = RSConstants.GPIO_FLAG_ON if self.state else RSConstants.GPIO_FLAG_OFF
+        return struct.pack('!BBBB', flag, RSConstants.GPIO_FRE, state, RSConstants.GPIO_RES)
+
+    def module_info_body(self, status=1):
+        body = b''
+        for value in (self.hw_version, self.sw_version, self.device_name):
+            value = value.encode()
+            body += bytes([len(value)]) + value
+        return body + bytes([status])
+
+    def handle(self, message_index, command, request):
+        if command == RSCommand.SET_GPIO_STATUS:
+            self.state = request.state
+            body = self.gpio_body(request.flag)
+        elif command == RSCommand.GET_GPIO_STATUS:
+            body = self.gpio_body(request.flag)
+        elif command == RSCommand.HEART_BEAT:
+            body = struct.pack('!H', self.heart_beat_interval)
+        elif command == RSCommand.QUERY_MODULE_INFO:
+            body = self.module_info_body()
+        else:
+            return None
+
+        _, response = RSMessages.build_message(self.device_config, command, body, message_index, reback=True)
+        return response
+
+    def report_gpio_change(self, flag=0):
+        _, report = RSMessages.build_message(self.device_config, RSCommand.REPORT_GPIO_CHANGE, self.gpio_body(flag))
+        return report
+
+
+class RSSimulatedStream(asyncio.Protocol):
+
+    # a tcp connection to the simulator, the requests cut from the stream are answered on the same stream
+    def __init__(self, parent):
+        self.parent = parent
+        self.transport = None
+        self.buffer = bytearray()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.parent.streams.add(self)
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self.parent.streams.discard(self)
+
+    def data_received(self, data):
+        self.buffer += data
+        try:
+            frames = RSMessages.split_frames(self.buffer)
+        except RSInvalidMessage:
+            self.transport.close()
+            return
+
+        for frame in frames:
+            self.parent.stream_received(self, frame)
+
+    def write(self, data):
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.write(data)
+            self.parent.sent += 1
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+class RSSimulator(asyncio.DatagramProtocol):
+
+    # a fleet of devices behind one loopback socket, requests are routed by the mac address in the header
+    def __init__(self, devices=(), latency=0.0, jitter=0.0, loss=0.0, report_address=None, report_rate=0.0):
+        self.devices = dict()
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.report_address = report_address
+        self.report_rate = report_rate
+        self.transport = None
+        self.streams = set()
+        self.report_task = None
+        self.received = 0
+        self.dropped = 0
+        self.sent = 0
+        self.reported = 0
+
+        for device in devices:
+            self.add_device(device)
+
+    @staticmethod
+    def create_devices(count, mac_prefix=b'\xF0\xFE\x6B', **kwargs):
+        return [RSSimulatedDevice(unpack_mac_address(mac_prefix + index.to_bytes(6 - len(mac_prefix), 'big')),
+                                  **kwargs) for index in range(count)]
+
+    def add_device(self, device):
+        self.devices[device.device_config.binary_mac_address] = device
+
+    def create_datagram_endpoint(self, loop=None, local_ip_address='127.0.0.1', local_port=0):
+        loop = loop if loop else asyncio.get_event_loop()
+        return loop.create_datagram_endpoint(lambda: self, local_addr=(local_ip_address, local_port))
+
+    def create_server(self, loop=None, local_ip_address='127.0.0.1', local_port=0):
+        # stand-in for the tcp port of the devices, the same fleet answers on both
+        loop = loop if loop else asyncio.get_event_loop()
+        return loop.create_server(lambda: RSSimulatedStream(self), local_ip_address, local_port)
+
+    @property
+    def local_address(self):
+        return self.transport.get_extra_info('sockname')
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if self.report_rate and self.report_address:
+            self.report_task = asyncio.ensure_future(self.report_loop())
+
+    def connection_lost(self, exc):
+        self.transport = None
+        if self.report_task:
+            self.report_task.cancel()
+
+    def datagram_received(self, datagram, remote_address):
+        self.received += 1
+        if self.loss and random.random() < self.loss:
+            self.dropped += 1
+            return
+
+        response, report = self.process(datagram)
+        if response is None:
+            return
+
+        if self.loss and random.random() < self.loss:
+            self.dropped += 1
+            return
+
+        self.send(response, remote_address)
+        if report is not None:
+            self.send(report, self.report_address)
+
+    def stream_received(self, stream, frame):
+        # a stream is reliable, loss doesn't apply
+        self.received += 1
+        response, report = self.process(frame)
+        if response is not None:
+            self.later(stream.write, response)
+        if report is not None:
+            self.send(report, self.report_address)
+
+    def process(self, datagram):
+        # the response and the report it triggers, if any
+        try:
+            device_config, message_index, command, request, _ = RSMessages.parse_message(datagram, with_header=True)
+        except RSInvalidMessage:
+            return None, None
+
+        device = self.devices.get(device_config.binary_mac_address)
+        response = device.handle(message_index, command, request) if device else None
+        report = None
+        if response is not None and command == RSCommand.SET_GPIO_STATUS and self.report_address:
+            report = device.report_gpio_change(request.flag)
+        return response, report
+
+    def send(self, datagram, remote_address):
+        self.later(self.sendto, datagram, remote_address)
+
+    def later(self, callback, *args):
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            asyncio.get_event_loop().call_later(delay, callback, *args)
+        else:
+            callback(*args)
+
+    def sendto(self, datagram, remote_address):
+        if self.transport:
+            self.transport.sendto(datagram, remote_address)
+            self.sent += 1
+
+    async def report_loop(self, tick=0.01):
+        # unsolicited relay changes, like someone pressing the button on the device
+        loop = asyncio.get_event_loop()
+        devices = list(self.devices.values())
+        last_time = loop.time()
+        budget = 0.0
+
+        while devices:
+            await asyncio.sleep(tick)
+            now = loop.time()
+            budget += self.report_rate * (now - last_time)
+            last_time = now
+
+            while budget >= 1:
+                budget -= 1
+                device = random.choice(devices)
+                device.state = not device.state
+                self.reported += 1
+                self.sendto(device.report_gpio_change(), self.report_address)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- Mode: Python; tab-width: 4 -*-
+#
+# pyrecswitch - interface for controlling Ankuoo RecSwitch MS6126
+# Copyright (C) 2018 Marco Lertora <marco.lertora@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import mmap
+import os
+import struct
+import time
+
+from .helpers import pack_mac_address, unpack_mac_address
+from .structures import GPIOStatus, ModuleInfo, RSRecord
+
+
+class RSSnapshotEntry(RSRecord):
+    __slots__ = ('mac_address', 'ip_address', 'port', 'heart_beat_interval', 'gpio_status', 'gpio_age',
+                 'module_info')
+
+    def __init__(self, mac_address=None, ip_address=None, port=None, heart_beat_interval=None, gpio_status=None,
+                 gpio_age=None, module_info=None):
+        self.mac_address = mac_address
+        self.ip_address = ip_address
+        self.port = port
+        self.heart_beat_interval = heart_beat_interval
+        self.gpio_status = gpio_status
+        self.gpio_age = gpio_age
+        self.module_info = module_info
+
+
+class RSSnapshot:
+    magic = b'RSSNAP'
+    version = 1
+    # magic, version, saved at (unix time), entries
+    header_struct = struct.Struct('!6sBdI')
+    # binary mac address, port, heart beat interval, flags, gpio flag, module status, gpio status age,
+    # offset and length of the strings: ip address, hw version, sw version, device name
+    entry_struct = struct.Struct('!6sHHBBBfIH')
+    has_gpio_status = 0x01
+    gpio_state_on = 0x02
+    has_module_info = 0x04
+
+    # read only view on a snapshot file, entries are sorted by mac address and decoded on access
+    def __init__(self, path):
+        with open(path, 'rb') as fh:
+            self.data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.saved_time, self.count = self.header_struct.unpack_from(self.data)
+        if magic != self.magic or version != self.version:
+            self.close()
+            raise ValueError('invalid snapshot file: {}'.format(path))
+
+        self.entries_offset = self.header_struct.size
+        self.strings_offset = self.entries_offset + self.count * self.entry_struct.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return self.decode(index)
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self.decode(index)
+
+    def close(self):
+        self.data.close()
+
+    def binary_mac_address(self, index):
+        offset = self.entries_offset + index * self.entry_struct.size
+        return self.data[offset:offset + 6]
+
+    def get(self, mac_address):
+        # binary search, the rest of the file is not touched
+        binary_mac_address = pack_mac_address(mac_address)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.binary_mac_address(middle) < binary_mac_address:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.binary_mac_address(low) == binary_mac_address:
+            return self.decode(low)
+        return None
+
+    def decode(self, index):
+        (binary_mac_address, port, heart_beat_interval, flags, gpio_flag, module_status, gpio_age,
+         strings_offset, strings_length) = self.entry_struct.unpack_from(
+            self.data, self.entries_offset + index * self.entry_struct.size)
+
+        offset = self.strings_offset + strings_offset
+        strings = list()
+        while offset < self.strings_offset + strings_offset + strings_length:
+            length = self.data[offset]
+            strings.append(self.data[offset + 1:offset + 1 + length].decode())
+            offset += length + 1
+
+        entry = RSSnapshotEntry(unpack_mac_address(binary_mac_address), strings[0], port, heart_beat_interval)
+        if flags & self.has_gpio_status:
+            entry.gpio_status = GPIOStatus(flag=gpio_flag, state=bool(flags & self.gpio_state_on))
+            entry.gpio_age = gpio_age
+        if flags & self.has_module_info:
+            entry.module_info = ModuleInfo(hw_version=strings[1], sw_version=strings[2], device_name=strings[3],
+                                           status=module_status)
+        return entry
+
+    @staticmethod
+    def encode_strings(*values):
+        data = bytearray()
+        for value in values:
+            value = (value or '').encode()
+            if len(value) > 0xFF:
+                raise ValueError('snapshot string too long: {!r}'.format(value))
+            data.append(len(value))
+            data += value
+        return data
+
+    @classmethod
+    def write(cls, path, entries, saved_time=None):
+        saved_time = saved_time if saved_time is not None else time.time()
+        entries = sorted(entries, key=lambda entry: pack_mac_address(entry.mac_address))
+
+        records = bytearray(cls.header_struct.pack(cls.magic, cls.version, saved_time, len(entries)))
+        strings = bytearray()
+        for entry in entries:
+            flags = 0
+            gpio_flag = 0
+            module_status = 0
+            gpio_age = 0.0
+            values = [entry.ip_address]
+
+            if entry.gpio_status is not None:
+                flags |= cls.has_gpio_status
+                flags |= cls.gpio_state_on if entry.gpio_status.state else 0
+                gpio_flag = entry.gpio_status.flag or 0
+                gpio_age = entry.gpio_age or 0.0
+
+            info = entry.module_info
+            if info is not None:
+                flags |= cls.has_module_info
+                module_status = info.status or 0
+                values.extend((info.hw_version, info.sw_version, info.device_name))
+
+            data = cls.encode_strings(*values)
+            records += cls.entry_struct.pack(pack_mac_address(entry.mac_address), entry.port,
+                                             int(entry.heart_beat_interval), flags, gpio_flag, module_status, gpio_age,
+                                             len(strings), len(data))
+            strings += data
+
+        # written aside and renamed, a crash never leaves a truncated snapshot behind
+        temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temporary_path, 'wb') as fh:
+            fh.write(records)
+            fh.write(strings)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(temporary_path, path)
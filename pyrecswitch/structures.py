@@ -18,30 +18,64 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from random import randint
-from types import SimpleNamespace
+from weakref import WeakValueDictionary
 
-from .helpers import pack_mac_address
+from .helpers import pack_mac_address, unpack_mac_address
 
 
-class RSDeviceConfig(SimpleNamespace):
+class RSDeviceConfig:
+    # class level defaults, an instance only stores the values set on it
     device_type = 0xD1
     factory_code = 0xF1
     license_data = 0x21B4
     use_encryption = True
     aes_iv = b'1234567890abcdef'
     aes_key = b'1234567890abcdef'
+    # None picks the first AES library installed
+    cipher_backend = None
     default_udp_port = 18530
     default_tcp_port = 17531
     min_message_index = 0x0001
     max_message_index = 0xFFFF
+    frame_builder = None
 
-    def __init__(self, mac_address):
-        self.mac_address = mac_address
-        super(RSDeviceConfig, self).__init__()
+    # interned configs by binary mac address, alive as long as someone holds them
+    instances = WeakValueDictionary()
+
+    def __init__(self, mac_address=None, binary_mac_address=None):
+        self._mac_address = mac_address
+        self._binary_mac_address = binary_mac_address
+
+    @classmethod
+    def intern(cls, mac_address=None, binary_mac_address=None):
+        # one shared config per mac address, packets from a registered device reuse the config of the device
+        if binary_mac_address is None:
+            binary_mac_address = pack_mac_address(mac_address)
+        else:
+            binary_mac_address = bytes(binary_mac_address)
+
+        device_config = cls.instances.get(binary_mac_address)
+        if device_config is None:
+            # the mac address string is formatted from the bytes, whatever the case it was given in
+            device_config = cls.instances[binary_mac_address] = cls(binary_mac_address=binary_mac_address)
+        return device_config
+
+    @property
+    def mac_address(self):
+        if self._mac_address is None and self._binary_mac_address is not None:
+            self._mac_address = unpack_mac_address(self._binary_mac_address)
+        return self._mac_address
+
+    @mac_address.setter
+    def mac_address(self, mac_address):
+        self._mac_address = mac_address
+        self._binary_mac_address = None
 
     @property
     def binary_mac_address(self):
-        return pack_mac_address(self.mac_address)
+        if self._binary_mac_address is None and self._mac_address is not None:
+            self._binary_mac_address = pack_mac_address(self._mac_address)
+        return self._binary_mac_address
 
     @staticmethod
     def new_message_index():
@@ -51,19 +85,66 @@ class RSDeviceConfig(SimpleNamespace):
         return '{}({})'.format(self.__class__.__name__, self.mac_address)
 
 
-class GPIOStatus(SimpleNamespace):
-    flag = None
-    state = None
+class RSRecord:
+    __slots__ = ()
+
+    def __repr__(self):
+        fields = ', '.join('{}={!r}'.format(name, getattr(self, name)) for name in self.__slots__)
+        return '{}({})'.format(self.__class__.__name__, fields)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    # mutable, like the namespaces they replace
+    __hash__ = None
 
 
-class ModuleInfo(SimpleNamespace):
-    hw_version = None
-    sw_version = None
-    device_name = None
+class GPIOStatus(RSRecord):
+    __slots__ = ('flag', 'state')
 
+    def __init__(self, flag=None, state=None):
+        self.flag = flag
+        self.state = state
 
-class HeartBeat(SimpleNamespace):
-    interval = None
 
+class ModuleInfo(RSRecord):
+    __slots__ = ('hw_version', 'sw_version', 'device_name', 'status')
 
+    def __init__(self, hw_version=None, sw_version=None, device_name=None, status=None):
+        self.hw_version = hw_version
+        self.sw_version = sw_version
+        self.device_name = device_name
+        self.status = status
 
+
+class HeartBeat(RSRecord):
+    __slots__ = ('interval',)
+
+    def __init__(self, interval=None):
+        self.interval = interval
+
+
+class RSHeader(RSRecord):
+    __slots__ = ('flag', 'device_type', 'factory_code', 'license_data')
+
+    def __init__(self, flag=None, device_type=None, factory_code=None, license_data=None):
+        self.flag = flag
+        self.device_type = device_type
+        self.factory_code = factory_code
+        self.license_data = license_data
+
+
+class RSEvent(RSRecord):
+    __slots__ = ('device_config', 'command', 'response', 'received_time')
+
+    def __init__(self, device_config=None, command=None, response=None, received_time=None):
+        self.device_config = device_config
+        self.command = command
+        self.response = response
+        self.received_time = received_time
+
+    @property
+    def mac_address(self):
+        return self.device_config.mac_address
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- Mode: Python; tab-width: 4 -*-
+#
+# pyrecswitch - interface for controlling Ankuoo RecSwitch MS6126
+# Copyright (C) 2018 Marco Lertora <marco.lertora@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import abc
+import asyncio
+import heapq
+import itertools
+import math
+
+
+class RSTimerWheel:
+
+    # hashed timing wheel, all the timers share a single event loop handle that fires once per tick
+    def __init__(self, granularity=0.1, wheel_size=512):
+        self.granularity = granularity
+        self.wheel_size = wheel_size
+        self.slots = [dict() for _ in range(wheel_size)]
+        self.timers = dict()
+        self.loop = None
+        self.handle = None
+        self.origin = None
+        self.current_tick = 0
+
+    def __len__(self):
+        return len(self.timers)
+
+    def __contains__(self, key):
+        return key in self.timers
+
+    def elapsed_ticks(self):
+        # the loop may run a handle slightly before its deadline, allow for clock resolution
+        return math.floor((self.loop.time() - self.origin) / self.granularity + 1e-6)
+
+    def schedule(self, key, delay, callback, *args):
+        if key in self.timers:
+            self.cancel(key)
+
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+            self.origin = self.loop.time()
+
+        if self.handle is None:
+            # nothing pending, move the wheel forward without walking the idle slots
+            self.current_tick = max(self.current_tick, self.elapsed_ticks())
+
+        expire_tick = math.ceil((self.loop.time() + delay - self.origin) / self.granularity)
+        expire_tick = max(expire_tick, self.current_tick + 1)
+        slot = self.slots[expire_tick % self.wheel_size]
+        slot[key] = (expire_tick, callback, args)
+        self.timers[key] = slot
+
+        if self.handle is None:
+            self.schedule_tick()
+
+    def cancel(self, key):
+        slot = self.timers.pop(key, None)
+        if slot is not None:
+            del slot[key]
+
+    def schedule_tick(self):
+        when = self.origin + (self.current_tick + 1) * self.granularity
+        self.handle = self.loop.call_at(when, self.tick)
+
+    def tick(self):
+        elapsed_ticks = self.elapsed_ticks()
+
+        while self.current_tick < elapsed_ticks and self.timers:
+            self.current_tick += 1
+            slot = self.slots[self.current_tick % self.wheel_size]
+            if not slot:
+                continue
+
+            expired = [key for key, (expire_tick, _, _) in slot.items() if expire_tick <= self.current_tick]
+            for key in expired:
+                if key not in slot:
+                    continue
+                expire_tick, callback, args = slot.pop(key)
+                del self.timers[key]
+                try:
+                    callback(*args)
+                except Exception as e:
+                    self.loop.call_exception_handler({'message': 'timer callback failed', 'exception': e})
+
+        self.handle = None
+        if self.timers:
+            self.schedule_tick()
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        for slot in self.slots:
+            slot.clear()
+        self.timers.clear()
+
+
+class RSTimerHeap(abc.ABC):
+
+    # a heap served by one task started on the first push, sleeping until process() is due again or a push puts a
+    # new entry on top. process() handles what is due and returns the seconds until the next run, None when done
+    def __init__(self):
+        self.queue = list()
+        self.sequence = itertools.count()
+        self.task = None
+        self.wakeup = None
+
+    def push(self, entry):
+        heapq.heappush(self.queue, entry)
+
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+        elif self.queue[0] is entry:
+            self.wake()
+
+    def wake(self):
+        if self.wakeup is not None and not self.wakeup.done():
+            self.wakeup.set_result(None)
+
+    @abc.abstractmethod
+    def process(self):
+        pass
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while self.queue:
+            delay = self.process()
+            if delay is None:
+                break
+
+            self.wakeup = loop.create_future()
+            handle = loop.call_later(delay, self.wake)
+            try:
+                await self.wakeup
+            finally:
+                handle.cancel()
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.queue.clear()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- Mode: Python; tab-width: 4 -*-
+#
+# pyrecswitch - interface for controlling Ankuoo RecSwitch MS6126
+# Copyright (C) 2018 Marco Lertora <marco.lertora@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import socket
+from collections import deque
+
+
+class RSBatchedDatagramTransport(asyncio.DatagramTransport):
+
+    # drains every queued datagram on a readiness event into a preallocated buffer and hands them to the
+    # protocol as one batch, outgoing datagrams are flushed once per loop iteration.
+    # the datagrams are memoryviews on the buffer, the protocol must copy what it keeps after the call.
+    # the protocol returns how many datagrams it processed, when it pauses the reading in the middle of a batch
+    # the others are kept and handed over first on resume_reading
+    def __init__(self, loop, sock, protocol, max_batch=64, datagram_size=2048):
+        super(RSBatchedDatagramTransport, self).__init__()
+        self.loop = loop
+        self.sock = sock
+        self.protocol = protocol
+        self.max_batch = max_batch
+        self.datagram_size = datagram_size
+        self.buffer = memoryview(bytearray(max_batch * datagram_size))
+        self.outgoing = deque()
+        self.flush_handle = None
+        self.writing = False
+        self.closing = False
+        self.reading = True
+        self.held = None
+        self.extra = {'socket': sock, 'sockname': sock.getsockname()}
+        self.loop.add_reader(self.sock.fileno(), self.read_ready)
+
+    def get_extra_info(self, name, default=None):
+        return self.extra.get(name, default)
+
+    def get_protocol(self):
+        return self.protocol
+
+    def set_protocol(self, protocol):
+        self.protocol = protocol
+
+    def is_closing(self):
+        return self.closing
+
+    def is_reading(self):
+        return self.reading and not self.closing
+
+    def pause_reading(self):
+        if self.is_reading():
+            self.reading = False
+            self.loop.remove_reader(self.sock.fileno())
+
+    def resume_reading(self):
+        if not self.reading and not self.closing:
+            self.reading = True
+            if self.held is None:
+                self.loop.add_reader(self.sock.fileno(), self.read_ready)
+            else:
+                self.loop.call_soon(self.release_held)
+
+    def release_held(self):
+        if not self.is_reading() or self.held is None:
+            return
+        held, self.held = self.held, None
+        self.deliver(held)
+        if self.is_reading() and self.held is None:
+            self.loop.add_reader(self.sock.fileno(), self.read_ready)
+
+    def get_write_buffer_size(self):
+        return sum(len(data) for data, _ in self.outgoing)
+
+    def read_ready(self):
+        batch = list()
+        for offset in range(0, len(self.buffer), self.datagram_size):
+            if not self.reading:
+                break
+            view = self.buffer[offset:offset + self.datagram_size]
+            try:
+                length, remote_address = self.sock.recvfrom_into(view)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                self.protocol.error_received(e)
+                break
+            batch.append((view[:length], remote_address))
+
+        if batch:
+            self.deliver(batch)
+
+    def deliver(self, batch):
+        processed = self.protocol.datagrams_received(batch)
+        if processed is not None and processed < len(batch):
+            # out of the buffer, the next read reuses it
+            self.held = [(bytes(datagram), remote_address) for datagram, remote_address in batch[processed:]]
+
+    def sendto(self, data, addr=None):
+        if self.closing:
+            return
+        self.outgoing.append((bytes(data), addr))
+        if self.flush_handle is None and not self.writing:
+            self.flush_handle = self.loop.call_soon(self.flush)
+
+    def flush(self):
+        self.flush_handle = None
+        while self.outgoing:
+            data, addr = self.outgoing[0]
+            try:
+                self.sock.sendto(data, addr)
+            except (BlockingIOError, InterruptedError):
+                if not self.writing:
+                    self.writing = True
+                    self.loop.add_writer(self.sock.fileno(), self.flush)
+                return
+            except OSError as e:
+                self.protocol.error_received(e)
+            self.outgoing.popleft()
+
+        if self.writing:
+            self.writing = False
+            self.loop.remove_writer(self.sock.fileno())
+
+        if self.closing:
+            self.close_socket()
+
+    def close(self):
+        if self.closing:
+            return
+        self.closing = True
+        self.loop.remove_reader(self.sock.fileno())
+        if not self.outgoing:
+            self.close_socket()
+
+    def abort(self):
+        self.outgoing.clear()
+        if not self.closing:
+            self.closing = True
+            self.loop.remove_reader(self.sock.fileno())
+        self.close_socket()
+
+    def close_socket(self):
+        if self.sock.fileno() == -1:
+            return
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.writing:
+            self.writing = False
+            self.loop.remove_writer(self.sock.fileno())
+        self.sock.close()
+        self.loop.call_soon(self.protocol.connection_lost, None)
+
+
+async def create_batched_datagram_endpoint(loop, protocol, local_addr, max_batch=64, datagram_size=2048,
+                                           receive_buffer_size=None):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setblocking(False)
+        if receive_buffer_size:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer_size)
+        sock.bind(local_addr)
+        transport = RSBatchedDatagramTransport(loop, sock, protocol, max_batch=max_batch,
+                                               datagram_size=datagram_size)
+    except OSError:
+        sock.close()
+        raise
+
+    protocol.connection_made(transport)
+    return transport, protocol
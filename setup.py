@@ -17,6 +17,9 @@ setuptools.setup(
     install_requires=[
             "pycryptodome>=3.6.6",
     ],
+    extras_require={
+            "cryptography": ["cryptography"],
+    },
     classifiers=(
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: GNU Affero General Public License v3 or later (AGPLv3+)",